@@ -2,6 +2,7 @@ from collections import OrderedDict
 import sqlite3
 from enum import Enum
 import os
+import threading
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.background import BackgroundScheduler
 import json
@@ -33,8 +34,53 @@ class Permissions(Enum):
   CHANGE_STYLES                = 0b000001000000
   MANAGE_ONE_TIME_JOB_SCHEDULE = 0b000010000000
 
+class ProfileCache:
+  '''
+  Profiles of each database, kept in memory. The admin pages invalidate the cache
+  when they change the profiles. Changes made by other processes are noticed
+  through PRAGMA data_version, which changes whenever another connection commits
+  to the database. The cache reads through its own connection, so creating the
+  default profiles does not count as a change.
+  '''
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.connections = {}
+    self.profiles = {}
+
+  def get(self, db_path):
+    with self.lock:
+      conn = self.connections.get(db_path)
+      if conn is None:
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.connections[db_path] = conn
+      data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+
+      cached = self.profiles.get(db_path)
+      if cached is None or cached[0] != data_version:
+        cached = (data_version, read_profiles(conn))
+        self.profiles[db_path] = cached
+      return cached[1]
+
+  def invalidate(self, db_path):
+    with self.lock:
+      self.profiles.pop(db_path, None)
+      conn = self.connections.pop(db_path, None)
+      if conn is not None:
+        conn.close()
+
+profile_cache = ProfileCache()
+
 def load_profiles(db_path):
-  conn = sqlite3.connect(db_path)
+  '''
+  Profiles stored in the database. The returned dictionary is shared, so it must
+  not be modified.
+  '''
+  return profile_cache.get(db_path)
+
+def invalidate_profiles(db_path):
+  profile_cache.invalidate(db_path)
+
+def read_profiles(conn):
   cursor = conn.cursor()
 
   cursor.execute("""
@@ -110,7 +156,6 @@ def load_profiles(db_path):
     cursor.execute("SELECT name, time_per_end, num_ends, count_direction, allow_overtime, stones_per_end, description FROM server_profiles")
     rows = cursor.fetchall()
     conn.commit()
-  conn.close()
 
   profiles = OrderedDict()
   for row in rows:
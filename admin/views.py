@@ -7,7 +7,7 @@ import os
 from datetime import datetime, timedelta
 from apscheduler.triggers.cron import CronTrigger
 from urllib.parse import urlparse, urljoin
-from . import load_profiles, Permissions, DATABASE_PATH, STYLES_PATH, scheduler, jobstores
+from . import load_profiles, invalidate_profiles, Permissions, DATABASE_PATH, STYLES_PATH, scheduler, jobstores
 import json
 import copy
 import shutil
@@ -552,6 +552,7 @@ def manage_profiles():
         edit_profile(conn)
     finally:
       conn.close()
+      invalidate_profiles(DATABASE_PATH)
 
   return render_template("admin/profiles.html", profiles=load_profiles(DATABASE_PATH))
 
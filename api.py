@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request, render_template, send_file
+from flask import Flask, Response, jsonify, request, render_template, send_file, stream_with_context, abort, make_response
 from datetime import datetime
 from config import ConfigValue, bool_type
 from collections import OrderedDict
@@ -13,6 +13,13 @@ import sys
 import os
 import io
 import sqlite3
+import timer_state
+import style_renderer
+import collections
+import uuid
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import logging
 
 try:
   USING_WAITRESS = True
@@ -20,13 +27,99 @@ try:
 except ImportError:
   USING_WAITRESS = False
 
+logging.basicConfig()
+logger = logging.getLogger('api')
+logger.setLevel(logging.INFO)
+
 PROFILES = OrderedDict()
-PROFILE_ID = 0
-MESSAGES = []
+
+# Sheet served by the routes without a /sheets/<sheet_id> prefix
+DEFAULT_SHEET = "default"
+
+# Seconds between keep-alive comments on an idle stream
+STREAM_KEEPALIVE = 15
+
+# Identifies this run of the server in ETags
+SERVER_ID = "{:x}".format(int(time.time()))
 
 def timestamp():
   return datetime.now().timestamp()
 
+def default_config():
+  return {
+      "version": ConfigValue(0.1),
+      "time_per_end": ConfigValue(15*60, int),
+      "num_ends": ConfigValue(8, int),
+      "start_timestamp": ConfigValue(timestamp(), int),
+      "stop_timestamp": ConfigValue(timestamp(), int),
+      "timer_stop_uptime": ConfigValue(0, int),
+      "count_direction": ConfigValue(-1, int),
+      "allow_overtime": ConfigValue(False, bool_type),
+      "is_timer_running": ConfigValue(False, bool_type),
+      "stones_per_end": ConfigValue(8, int),
+      "count_in": ConfigValue(0, int),
+      "time_to_chime": ConfigValue(6000, int),
+      "game_type": ConfigValue("league", str),
+      # Transition timestamps, see timer_state.calc_phase
+      "count_in_deadline": ConfigValue(0, int),
+      "overtime_timestamp": ConfigValue(0, int),
+      "complete_timestamp": ConfigValue(0, int)
+  }
+
+class Sheet:
+  '''
+  Timer for a single sheet of ice
+  '''
+  def __init__(self, name):
+    self.name = name
+    self.state = timer_state.TimerState(default_config())
+    self.profile_id = 0
+
+    # Messages waiting to be read through /messages. Reading them clears the list.
+    self.messages = []
+
+    # Recently broadcast messages, kept so that each connected stream can forward
+    # messages it has not seen yet. Unlike messages, reading a stream does not clear them.
+    self.message_log = collections.deque(maxlen=32)
+    self.message_id = 0
+
+    # JSON encoded payloads, each stored with the key it was built for
+    self._encoded = {}
+
+  def post_message(self, message):
+    with self.state.changed:
+      self.messages.append(message)
+      self.message_id += 1
+      self.message_log.append((self.message_id, message))
+      self.state.touch()
+
+  def pop_messages(self):
+    with self.state.changed:
+      messages, self.messages = self.messages, []
+    return messages
+
+  def encoded(self, name, key, build):
+    '''
+    Encoded payload returned by build(), reused for as long as key does not change
+    '''
+    cached = self._encoded.get(name)
+    if cached is None or cached[0] != key:
+      cached = (key, build())
+      self._encoded[name] = cached
+    return cached[1]
+
+SHEETS = OrderedDict()
+
+def add_sheet(name):
+  if name not in SHEETS:
+    SHEETS[name] = Sheet(name)
+  return SHEETS[name]
+
+def get_sheet(sheet_id):
+  if sheet_id not in SHEETS:
+    abort(make_response(jsonify({"error": "Sheet not found"}), 404))
+  return SHEETS[sheet_id]
+
 app = Flask(__name__)
 app.register_blueprint(admin, url_prefix='/admin')
 
@@ -41,71 +134,77 @@ app.config.update(
     SESSION_COOKIE_HTTPONLY=True,   # prevents JavaScript access
 )
 
-server_config = {
-    "version": ConfigValue(0.1),
-    "time_per_end": ConfigValue(15*60, int),
-    "num_ends": ConfigValue(8, int),
-    "start_timestamp": ConfigValue(timestamp(), int),
-    "stop_timestamp": ConfigValue(timestamp(), int),
-    "timer_stop_uptime": ConfigValue(0, int),
-    "count_direction": ConfigValue(-1, int),
-    "allow_overtime": ConfigValue(False, bool_type),
-    "is_timer_running": ConfigValue(False, bool_type),
-    "stones_per_end": ConfigValue(8, int),
-    "is_game_complete": ConfigValue(False, bool_type),
-    "count_in": ConfigValue(0, int),
-    "time_to_chime": ConfigValue(6000, int),
-    "game_type": ConfigValue("league", str)
-}
-
-@app.route('/', methods=['GET','POST'])
-def index():
+# The unprefixed routes belong to the default sheet. server_config is a read-only
+# view of its latest snapshot; changes go through a transaction on the sheet state.
+server_config = timer_state.ConfigView(add_sheet(DEFAULT_SHEET).state)
+
+def sheet_route(rule, **options):
+  '''
+  Register a route for every sheet under /sheets/<sheet_id>, and at the
+  unprefixed rule for the default sheet
+  '''
+  def decorator(f):
+    app.add_url_rule(rule, view_func=f, defaults={"sheet_id": DEFAULT_SHEET}, **options)
+    app.add_url_rule("/sheets/<sheet_id>" + rule, view_func=f, **options)
+    return f
+  return decorator
+
+def is_bonspiel_locked(config):
+  return timer_state.is_running(config, timestamp()) and config["game_type"] == "bonspiel"
+
+@sheet_route('/', methods=['GET','POST'])
+def index(sheet_id=DEFAULT_SHEET):
+  sheet = get_sheet(sheet_id)
   if request.method == 'POST':
     if "Start" in request.form:
-      # If previous game is done (timer done counting and overtime not allowed), then reset timer and start again
-      if server_config["is_game_complete"].value:
-        reset_timer()
+      with sheet.state.transaction() as config:
+        # If previous game is done (timer done counting and overtime not allowed), then reset timer and start again
+        if timer_state.calc_phase(config, timestamp()) == timer_state.Phase.COMPLETE:
+          reset(config)
 
-      start_timer()
+        start(config)
     elif "Stop" in request.form:
-      stop_timer()
+      with sheet.state.transaction() as config:
+        stop(config)
     elif "Reset" in request.form:
-      reset_timer()
+      with sheet.state.transaction() as config:
+        reset(config)
     elif "LoadProfile" in request.form:
-      if server_config["is_timer_running"].value and server_config["game_type"].value == "bonspiel":
+      if is_bonspiel_locked(sheet.state.snapshot.config):
         return jsonify({"error": "Cannot update config while timer is running in bonspiel mode"}), 400
 
       profile_name = request.form.get('profile_name')
-      update_config_with_profile(profile_name)
+      update_config_with_profile(sheet, profile_name)
     elif "AdjustTimer" in request.form:
       adjustDir = request.form.get('adjust_minutes_dir')
       adjustVal = request.form.get('adjust_minutes')
-      adjust_timer(adjustDir, adjustVal)
+      adjust_timer(sheet, adjustDir, adjustVal)
     else:
-      if server_config["is_timer_running"].value and server_config["game_type"].value == "bonspiel":
-        return jsonify({"error": "Cannot update config while timer is running in bonspiel mode"}), 400
-
-      # In bonspiel mode the number of ends is calculated automatically
-      update_config("game_type", request.form.get("game_type"))
-      if server_config["game_type"].value != "bonspiel":
-        update_config("num_ends", request.form.get("num_ends"))
-      else:
-        update_config("time_to_chime", request.form.get("time_to_chime"))
-
-      update_config("time_per_end", request.form.get("time_per_end"))
-      update_config("count_direction", request.form.get("count_direction"))
-      update_config("allow_overtime", request.form.get("allow_overtime"))
-      update_config("stones_per_end", request.form.get("stones_per_end"))
-      update_config("count_in", request.form.get("count_in"))
-
-  data = {key: value.value for key,value in server_config.items()}
+      with sheet.state.transaction() as config:
+        if is_bonspiel_locked(config):
+          return jsonify({"error": "Cannot update config while timer is running in bonspiel mode"}), 400
+
+        # In bonspiel mode the number of ends is calculated automatically
+        config["game_type"] = request.form.get("game_type")
+        if config["game_type"] != "bonspiel":
+          config["num_ends"] = request.form.get("num_ends")
+        else:
+          config["time_to_chime"] = request.form.get("time_to_chime")
+
+        config["time_per_end"] = request.form.get("time_per_end")
+        config["count_direction"] = request.form.get("count_direction")
+        config["allow_overtime"] = request.form.get("allow_overtime")
+        config["stones_per_end"] = request.form.get("stones_per_end")
+        config["count_in"] = request.form.get("count_in")
+        timer_state.calc_num_bonspiel_ends(config)
+
+  payload = calc_game_times(sheet)
+  data = dict(payload["config"])
   profiles = load_profiles(DATABASE_PATH)
   data["profiles"] = profiles.keys()
   data["selected_profile_name"] = request.form.get('profile_name', None)
 
-  response, status = get_times()
-  times = response.json.get("times")
-  data.update(times)
+  data.update(payload["times"])
   return render_template('index.html', **data)
 
 @app.route('/style_preview', methods=['GET'])
@@ -120,30 +219,21 @@ def style_preview():
 
   return render_template('style_preview.html', styles=styles)
 
-def get_style_image(end_num, styles, percent=0.25):
-  import app
-  img_io = io.BytesIO()
-  clock = app.IceClock(headless=True, styles=styles)
-  clock._server_config = {k: v.value for k,v in server_config.items()}
-  total_time = server_config["time_per_end"].value * server_config["num_ends"].value
-  elapsed = server_config["time_per_end"].value * (end_num - 1) + percent * server_config["time_per_end"].value
-
-  clock._total_time = total_time
-  clock._hours = int((total_time-elapsed) // 3600)
-  clock._minutes = int(((total_time-elapsed) // 60) % 60)
-  clock._seconds = int((total_time-elapsed) % 60)
-  clock._end_number = end_num
-  clock._end_percentage = percent
-  clock._is_overtime = False
-  clock._uptime = elapsed
-  clock.render_to_image(img_io)
-
-  img_io.seek(0)
-  return img_io
-
-@app.route('/style_img', methods=['POST'])
-def style_img():
-  input_data = request.get_json()
+# Style previews are rendered in worker processes, and kept for identical requests
+render_service = style_renderer.RenderService()
+preview_cache = style_renderer.PreviewCache()
+
+def preview_config():
+  '''
+  Configuration of the default sheet, as seen by the displays
+  '''
+  config = SHEETS[DEFAULT_SHEET].state.snapshot.config
+  return timer_state.effective_config(config, timer_state.calc_times(config, timestamp()))
+
+def read_styles(input_data):
+  '''
+  Styles of a preview request, given inline or by the name of a styles file
+  '''
   if "styles" in input_data:
     styles=input_data["styles"]
   else:
@@ -153,21 +243,104 @@ def style_img():
       styles = json.load(f)
 
   styles["colors"] = {k: tuple(v) for k,v in styles["colors"].items()}
-  if input_data["image_settings"]["image_type"] == "normal":
-    end_num = 1
-    end_percent = 0.25
-  elif input_data["image_settings"]["image_type"] == "warning_1":
-    end_num = server_config["num_ends"].value - 1
-    end_percent = 0.5
-  elif input_data["image_settings"]["image_type"] == "warning_2":
-    end_num = server_config["num_ends"].value
-    end_percent = 0.5
-  else:
-    return jsonify({"error": "Invalid image type provided"}), 400
+  return styles
+
+def get_style_images(styles, scenarios, config):
+  '''
+  Preview images of styles for the named scenarios. Images that are not cached are
+  rendered together by one worker. Returns the cache key and the PNG image of each.
+  '''
+  # Images are cached by a hash of everything they depend on, which also serves as
+  # their ETag. The size of the images is only known once the workers have rendered one.
+  keys = {name: style_renderer.preview_key(styles, name, config, render_service.size) for name in scenarios}
+  images = {name: preview_cache.get(key) for name, key in keys.items()}
+  missing = [name for name, image in images.items() if image is None]
+  if missing:
+    for name, image in render_service.render(styles, config, missing).items():
+      keys[name] = style_renderer.preview_key(styles, name, config, render_service.size)
+      images[name] = image
+      preview_cache.put(keys[name], image)
+  return keys, images
+
+def not_modified(etag):
+  # Flask only answers GET requests conditionally, so previews check the ETag themselves
+  if not request.if_none_match.contains(etag):
+    return None
+  response = Response(status=304)
+  response.set_etag(etag)
+  return response
+
+def preview_response(response, etag):
+  response.set_etag(etag)
+  response.cache_control.private = True
+  response.cache_control.no_cache = True
+  return response
 
-  img_io = get_style_image(end_num, styles, percent = end_percent)
+@app.route('/style_img', methods=['POST'])
+def style_img():
+  input_data = request.get_json()
+  styles = read_styles(input_data)
+  config = preview_config()
+  image_type = input_data["image_settings"]["image_type"]
+  if image_type not in style_renderer.PREVIEW_SCENARIOS:
+    return jsonify({"error": "Invalid image type provided"}), 400
 
-  return send_file(img_io, mimetype='image/png')
+  etag = make_etag([style_renderer.preview_key(styles, image_type, config, render_service.size)])
+  response = not_modified(etag)
+  if response is not None:
+    return response
+
+  try:
+    keys, images = get_style_images(styles, [image_type], config)
+  except style_renderer.RenderQueueFull:
+    return jsonify({"error": "Too many previews are being rendered"}), 503
+  except concurrent.futures.TimeoutError:
+    return jsonify({"error": "Timed out rendering the preview"}), 504
+  except BrokenProcessPool:
+    return jsonify({"error": "The preview renderer stopped"}), 503
+
+  response = send_file(io.BytesIO(images[image_type]), mimetype='image/png')
+  return preview_response(response, make_etag([keys[image_type]]))
+
+@app.route('/style_imgs', methods=['POST'])
+def style_imgs():
+  '''
+  Preview images of one style for a list of scenarios, rendered in one pass. The images
+  are returned as multipart/form-data, with one PNG file named after each scenario.
+  '''
+  input_data = request.get_json()
+  styles = read_styles(input_data)
+  config = preview_config()
+  scenarios = input_data.get("scenarios", list(style_renderer.PREVIEW_SCENARIOS))
+  if not scenarios or any(name not in style_renderer.PREVIEW_SCENARIOS for name in scenarios):
+    return jsonify({"error": "Invalid scenario provided"}), 400
+
+  etag = make_etag([style_renderer.preview_key(styles, scenarios, config, render_service.size)])
+  response = not_modified(etag)
+  if response is not None:
+    return response
+
+  try:
+    keys, images = get_style_images(styles, scenarios, config)
+  except style_renderer.RenderQueueFull:
+    return jsonify({"error": "Too many previews are being rendered"}), 503
+  except concurrent.futures.TimeoutError:
+    return jsonify({"error": "Timed out rendering the preview"}), 504
+  except BrokenProcessPool:
+    return jsonify({"error": "The preview renderer stopped"}), 503
+
+  boundary = uuid.uuid4().hex
+  body = io.BytesIO()
+  for name in scenarios:
+    body.write("--{:s}\r\n".format(boundary).encode())
+    body.write('Content-Disposition: form-data; name="{0:s}"; filename="{0:s}.png"\r\n'.format(name).encode())
+    body.write(b"Content-Type: image/png\r\n\r\n")
+    body.write(images[name])
+    body.write(b"\r\n")
+  body.write("--{:s}--\r\n".format(boundary).encode())
+
+  response = Response(body.getvalue(), content_type="multipart/form-data; boundary={:s}".format(boundary))
+  return preview_response(response, make_etag([style_renderer.preview_key(styles, scenarios, config, render_service.size)]))
 
 @app.route('/download_style', methods=['POST'])
 def download_style():
@@ -182,166 +355,325 @@ def download_style():
 
   return send_file(file_stream, as_attachment=True, download_name="user_styles.json", mimetype="text/plain")
 
+
 @app.route('/version', methods=['GET'])
 def get_version():
   return jsonify({"version": server_config["version"]})
 
-@app.route('/config', methods=['GET'])
-def query_key():
+@sheet_route('/config', methods=['GET'])
+def query_key(sheet_id=DEFAULT_SHEET):
+  sheet = get_sheet(sheet_id)
   key = request.args.get('key')
   if not key:
-    return jsonify(server_config), 200
-
-  if key in server_config:
-    return jsonify({key: server_config[key].value}), 200
+    snapshot = sheet.state.snapshot
+    times = timer_state.calc_times(snapshot.config, timestamp())
+    config = lambda: timer_state.effective_config(snapshot.config, times)
+    body = sheet.encoded("config_values", config_key(snapshot, times),
+                         lambda: encode_json({key: {"value": value} for key, value in config().items()}))
+    return json_response(body, snapshot.version, make_etag(config_key(snapshot, times)))
+
+  config = calc_game_times(sheet)["config"]
+  if key in config:
+    return jsonify({key: config[key]}), 200
   else:
     return jsonify({"error": "Key not found"}), 404
 
-def calc_num_bonspiel_ends():
-  if server_config["game_type"].value != "bonspiel":
-    return
-  time_to_chime = server_config["time_to_chime"].value
-  time_per_end = server_config["time_per_end"].value
-  # int rounds down, so if the chime occurs during an end we need to add
-  # that end, then one more.
-  server_config["num_ends"].value = int(time_to_chime/time_per_end) + 2
-
-@app.route('/update', methods=['GET'])
-def update_config_route():
-  if server_config["is_timer_running"].value and server_config["game_type"].value == "bonspiel":
-    return jsonify({"error": "Cannot update config while timer is running in bonspiel mode"}), 400
-
-  key = request.args.get('key')
-  if not key:
-    return jsonify({"error": "No key provided"}), 400
-  if key not in server_config:
-    return jsonify({"error": "Key not found"}), 500
-
-  if server_config["game_type"].value == "bonspiel" and key == "num_ends":
-    return jsonify({"error": "Number of ends cannot be updated in bonspiel mode"}), 400
-  calc_num_bonspiel_ends()
+@sheet_route('/update', methods=['GET'])
+def update_config_route(sheet_id=DEFAULT_SHEET):
+  sheet = get_sheet(sheet_id)
+  with sheet.state.transaction() as config:
+    if is_bonspiel_locked(config):
+      return jsonify({"error": "Cannot update config while timer is running in bonspiel mode"}), 400
+
+    key = request.args.get('key')
+    if not key:
+      return jsonify({"error": "No key provided"}), 400
+    if key not in config:
+      return jsonify({"error": "Key not found"}), 500
+
+    if config["game_type"] == "bonspiel" and key == "num_ends":
+      return jsonify({"error": "Number of ends cannot be updated in bonspiel mode"}), 400
+
+    new_value = request.args.get("value")
+    if not new_value:
+      return jsonify({"error": "No value provided"}), 400
+
+    config[key] = new_value
+    timer_state.calc_num_bonspiel_ends(config)
+  return jsonify({key: sheet.state.snapshot.config[key]}), 200
+
+@sheet_route('/update', methods=['POST'])
+def update_config_batch(sheet_id=DEFAULT_SHEET):
+  '''
+  Apply several changes to the config as a single change of state. The JSON body
+  may contain:
+    reset   - if true, reset the timer first
+    profile - name of a profile to load
+    values  - mapping of config keys to new values, applied after the profile
+    start   - if true, start the timer last
+  Either every change is applied or none of them are.
+  '''
+  sheet = get_sheet(sheet_id)
+  batch = request.get_json(silent=True)
+  if not isinstance(batch, dict) or not isinstance(batch.get("values", {}), dict):
+    return jsonify({"error": "Expected a JSON object"}), 400
+
+  values = batch.get("values", {})
+  profile_name = batch.get("profile")
+  profiles = load_profiles(DATABASE_PATH)
+  if profile_name is not None and profile_name not in profiles:
+    return jsonify({"error": "Profile not found"}), 400
 
+  try:
+    with sheet.state.transaction() as config:
+      # Check the batch before changing anything, so that nothing is published if it is refused
+      if (values or profile_name is not None) and is_bonspiel_locked(config) and not batch.get("reset"):
+        return jsonify({"error": "Cannot update config while timer is running in bonspiel mode"}), 400
 
-  new_value = request.args.get("value")
-  if new_value:
-    update_config(key, new_value)
-    return jsonify({key: server_config[key].value}), 200
-  return jsonify({"error": "No value provided"}), 400
+      unknown = [key for key in values if key not in config]
+      if unknown:
+        return jsonify({"error": "Key not found", "keys": unknown}), 400
+
+      if values.get("game_type", config["game_type"]) == "bonspiel" and "num_ends" in values:
+        return jsonify({"error": "Number of ends cannot be updated in bonspiel mode"}), 400
+
+      if batch.get("reset"):
+        reset(config)
+      if profile_name is not None:
+        apply_profile(config, profiles[profile_name])
+      for key, value in values.items():
+        config[key] = value
+      timer_state.calc_num_bonspiel_ends(config)
+      if batch.get("start"):
+        start(config)
+  except (ValueError, TypeError, ZeroDivisionError) as e:
+    return jsonify({"error": "Invalid value: {}".format(e)}), 400
+
+  return config_response(sheet), 200
+
+def start(config):
+  now = int(timestamp())
+  if timer_state.is_running(config, now):
+    return
 
-def update_config(key, new_value):
-  global server_config
-  server_config[key].value = new_value
-  calc_num_bonspiel_ends()
+  # A game that completed while the timer was running is stopped where it ended first
+  if config["is_timer_running"]:
+    halt(config, now)
+  config["is_timer_running"] = True
 
-@app.route('/start', methods=['GET'])
-def start_timer():
-  global server_config
-  server_config["is_timer_running"].value = True
+  # The clock starts once the count in is over
+  config["count_in_deadline"] = now + config["count_in"]
+  config["count_in"] = 0
 
   #if the timer was already paused, need to account for the amount of time the timer
   #had already elapsed. Otherwise this would essentially reset the timer.
-  server_config["start_timestamp"].value = timestamp() - server_config["timer_stop_uptime"].value
+  config["start_timestamp"] = config["count_in_deadline"] - config["timer_stop_uptime"]
 
-  return jsonify({"start_timestamp": server_config["start_timestamp"].value}), 200
-
-@app.route('/stop', methods=['GET'])
-def stop_timer():
-  global server_config
-  server_config["is_timer_running"].value = False
-  server_config["stop_timestamp"].value = timestamp()
+def stop(config):
+  now = int(timestamp())
+  if not timer_state.is_running(config, now):
+    return
+  halt(config, now)
 
+def halt(config, now):
   #update the uptime each time we stop, so we know how much time had already elapsed at the time of stoppage
-  server_config["timer_stop_uptime"].value = server_config["stop_timestamp"].value - server_config["start_timestamp"].value
+  times = timer_state.calc_times(config, now)
+  config["is_timer_running"] = False
+  config["stop_timestamp"] = now
+  config["start_timestamp"] = now - times["uptime"]
+  config["timer_stop_uptime"] = times["uptime"]
 
-  return jsonify({"stop_timestamp": server_config["stop_timestamp"].value}), 200
+  # Keep what is left of the count in, so it carries on from there when the timer starts again
+  config["count_in"] = times["count_in"]
+  config["count_in_deadline"] = 0
 
-@app.route('/reset', methods=['GET'])
-def reset_timer():
-  global server_config
-  time = request.args.get('time')
+def reset(config, time=None):
   if not time:
-    server_config["start_timestamp"].value = timestamp()
-    server_config["stop_timestamp"].value = timestamp()
+    config["start_timestamp"] = timestamp()
+    config["stop_timestamp"] = timestamp()
   else:
-    server_config["start_timestamp"].value = time
-    server_config["stop_timestamp"].value = time
+    config["start_timestamp"] = time
+    config["stop_timestamp"] = time
 
-  server_config["is_game_complete"].value = False
-  server_config["timer_stop_uptime"].value = 0
+  config["timer_stop_uptime"] = 0
 
   #always stop timer when reseting time
-  server_config["is_timer_running"].value = False
-
-  server_config["count_in"].value = 0
-
-  return jsonify({"start_timestamp": server_config["start_timestamp"].value}), 200
-
-@app.route('/game_times', methods=['GET'])
-def get_times():
-  global server_config
-  # Get how long the timer has been running
-  if server_config["is_timer_running"].value and server_config["count_in"].value > 0:
-    server_config["count_in"].value -= 1
-    uptime = 0
-  elif server_config["is_timer_running"].value == True:
-    current_time = timestamp()
-    uptime = int(current_time) - server_config["start_timestamp"].value
-  else:
-    current_time = server_config["stop_timestamp"].value
-    uptime = int(current_time) - server_config["start_timestamp"].value
-
-  # Initialize results dictionary
-  times = {}
-  times["uptime"] = uptime
-
-  # End number and percentage are always based on the uptime of the timer
-  times["end_number"] = uptime // server_config["time_per_end"].value + 1
-  times["end_percentage"] = uptime/server_config["time_per_end"].value - times["end_number"] + 1
-
-  # Calculate the total time of the game, then figure out which time to split into
-  # hours, minutes, and seconds depending on if we're counting down or up
-  league_time = server_config["time_per_end"].value * server_config["num_ends"].value
-  if server_config["game_type"].value != "bonspiel":
-    times["total_time"] = league_time
-  else:
-    times["total_time"] = server_config["time_to_chime"].value
-  game_time = times["total_time"] - uptime if server_config["count_direction"].value < 0 else uptime
-
-  # Determine if we're over time or not. If allow_overtime is false, then the over time flag will always be false
-  times["is_overtime"] = uptime > times["total_time"] and server_config["allow_overtime"].value
-
-  # If we don't allow overtime and the timer is done, directly call the stop function so timing stops
-  # and set the time to 0 or total time, so it stays that way
-  if uptime >= league_time and not server_config["allow_overtime"].value:
-    stop_timer()
-    game_time = 0 if server_config["count_direction"].value < 0 else times["total_time"]
-    server_config["is_game_complete"].value = True
-  else:
-    server_config["is_game_complete"].value = False
-
-  # If we're over time, then return how far over time we are
-  if times["is_overtime"] and server_config["count_direction"].value < 0:
-    game_time = game_time*-1
-
-  # Divide the time into hours, minutes, seconds
-  if not server_config["count_in"].value:
-    times["hours"] = game_time // 3600
-    times["minutes"] = (game_time // 60) % 60
-    times["seconds"] = game_time % 60
-  else:
-    times["hours"] = server_config["count_in"].value // 3600
-    times["minutes"] = (server_config["count_in"].value // 60) % 60
-    times["seconds"] = server_config["count_in"].value % 60
+  config["is_timer_running"] = False
+
+  config["count_in"] = 0
+  config["count_in_deadline"] = 0
+
+@sheet_route('/start', methods=['GET'])
+def start_timer(sheet_id=DEFAULT_SHEET):
+  sheet = get_sheet(sheet_id)
+  with sheet.state.transaction() as config:
+    start(config)
+
+  return jsonify({"start_timestamp": config["start_timestamp"]}), 200
+
+@sheet_route('/stop', methods=['GET'])
+def stop_timer(sheet_id=DEFAULT_SHEET):
+  sheet = get_sheet(sheet_id)
+  with sheet.state.transaction() as config:
+    stop(config)
+
+  return jsonify({"stop_timestamp": config["stop_timestamp"]}), 200
+
+@sheet_route('/reset', methods=['GET'])
+def reset_timer(sheet_id=DEFAULT_SHEET):
+  sheet = get_sheet(sheet_id)
+  with sheet.state.transaction() as config:
+    reset(config, request.args.get('time'))
+
+  return jsonify({"start_timestamp": config["start_timestamp"]}), 200
+
+@sheet_route('/game_times', methods=['GET'])
+def get_times(sheet_id=DEFAULT_SHEET):
+  sheet = get_sheet(sheet_id)
+  snapshot = sheet.state.snapshot
+  now = int(timestamp())
+  body = encode_game_times(sheet, snapshot, now)
+  return json_response(body, snapshot.version, make_etag(game_times_key(snapshot, now)))
+
+@app.route('/sheets', methods=['GET'])
+def list_sheets():
+  return jsonify({"sheets": list(SHEETS.keys())}), 200
+
+@app.route('/sheets/game_times', methods=['GET'])
+def get_all_times():
+  '''
+  Time state of every sheet in a single response, keyed by sheet
+  '''
+  now = int(timestamp())
+  payloads = [json.dumps(name).encode() + b": " + encode_game_times(sheet, sheet.state.snapshot, now) for name, sheet in SHEETS.items()]
+  return Response(b'{"sheets": {' + b", ".join(payloads) + b"}}", mimetype=app.json.mimetype), 200
+
+def calc_game_times(sheet):
+  '''
+  Compute the current time state of the timer. Returns the payload shared by
+  /game_times and /stream. This only reads the state; the phase of the timer
+  is evaluated from the snapshot and the current time.
+  '''
+  snapshot = sheet.state.snapshot
+  times = timer_state.calc_times(snapshot.config, timestamp())
 
   # Include the server config in the returned value for convenience and to limit
   # network traffic required to update the front end
-  retVal = {"times": times, "config": {key: server_config[key].value for key in server_config}}
-  return jsonify(retVal), 200
-
-@app.route('/load_profile', methods=['GET'])
-def load_profile():
-  global server_config
-  if server_config["is_timer_running"].value and server_config["game_type"].value == "bonspiel":
+  return {"times": times, "config": timer_state.effective_config(snapshot.config, times), "state_version": snapshot.version}
+
+def config_key(snapshot, times):
+  # The effective config only changes with the state and the values that depend on the time
+  return (snapshot.version, times["phase"] == timer_state.Phase.COMPLETE.value, times["count_in"])
+
+def encode_config(sheet, snapshot, times):
+  '''
+  JSON encoded effective config of a snapshot, rebuilt only when it changes
+  '''
+  return sheet.encoded("config", config_key(snapshot, times),
+                       lambda: encode_json(timer_state.effective_config(snapshot.config, times)))
+
+def game_times_key(snapshot, now):
+  # The times only change once per second while the timer is running, and not at all while it is stopped
+  return (snapshot.version, now if snapshot.config["is_timer_running"] else None)
+
+def encode_game_times(sheet, snapshot, now):
+  '''
+  JSON encoded payload of /game_times for a snapshot at the whole second `now`
+  '''
+  def build():
+    times = timer_state.calc_times(snapshot.config, now)
+    return b'{"times": ' + encode_json(times) + \
+           b', "config": ' + encode_config(sheet, snapshot, times) + \
+           b', "state_version": ' + str(snapshot.version).encode() + b'}'
+  return sheet.encoded("game_times", game_times_key(snapshot, now), build)
+
+def encode_json(data):
+  return app.json.dumps(data).encode()
+
+def config_response(sheet):
+  '''
+  Response carrying the effective config of a sheet
+  '''
+  snapshot = sheet.state.snapshot
+  times = timer_state.calc_times(snapshot.config, timestamp())
+  return json_response(encode_config(sheet, snapshot, times), snapshot.version)
+
+def make_etag(key):
+  # Versions start again from 0 when the server restarts, so the ETag also names the server instance
+  return "-".join([SERVER_ID] + [str(part) for part in key])
+
+def json_response(body, version, etag=None):
+  '''
+  Response for an already encoded JSON body. The state version it was built from
+  is reported in the X-State-Version header. If an ETag is given, the response
+  is 304 Not Modified when the request sends the same one in If-None-Match.
+  '''
+  response = Response(body, mimetype=app.json.mimetype, headers={"X-State-Version": str(version)})
+  if etag is not None:
+    response.set_etag(etag)
+    response.make_conditional(request)
+  return response
+
+def format_event(event, data):
+  return "event: {:s}\ndata: {:s}\n\n".format(event, data)
+
+@sheet_route('/stream', methods=['GET'])
+def stream(sheet_id=DEFAULT_SHEET):
+  '''
+  Server-Sent Events stream of the timer state. A "game_times" event carrying the
+  same payload as /game_times is pushed whenever the state changes, and once per
+  second while the timer is running. Broadcast messages are pushed as "messages"
+  events.
+  '''
+  sheet = get_sheet(sheet_id)
+  state = sheet.state
+
+  def generate():
+    version = None
+    with state.changed:
+      message_id = sheet.message_id
+
+    while True:
+      with state.changed:
+        if timer_state.is_running(state.snapshot.config, timestamp()):
+          # Wake up on the next whole second so the displayed seconds never skip
+          timeout = 1 - timestamp() % 1
+        else:
+          timeout = STREAM_KEEPALIVE
+        changed = state.changed.wait_for(lambda: state.version != version, timeout=timeout)
+        version = state.version
+        new_messages = [msg for msg in sheet.message_log if msg[0] > message_id]
+
+      if new_messages:
+        message_id = new_messages[-1][0]
+        yield format_event("messages", json.dumps({"messages": [msg for _, msg in new_messages]}))
+
+      # Keep ticking for one more second after the clock stops so that the frame
+      # showing the end of the game is pushed
+      if changed or timer_state.is_running(state.snapshot.config, timestamp() - 1):
+        yield format_event("game_times", encode_game_times(sheet, state.snapshot, int(timestamp())).decode())
+      else:
+        yield ": keep-alive\n\n"
+
+  headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+  return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
+@sheet_route('/time_sync', methods=['GET'])
+def time_sync(sheet_id=DEFAULT_SHEET):
+  '''
+  Report the server clocks so that displays can estimate their offset from the
+  server and extrapolate the timer locally. The state version tells a display
+  when it needs to fetch /game_times again, and the message id when it needs to
+  fetch /messages.
+  '''
+  sheet = get_sheet(sheet_id)
+  return jsonify({"server_time": timestamp(), "monotonic": time.monotonic(),
+                  "state_version": sheet.state.version, "message_id": sheet.message_id}), 200
+
+@sheet_route('/load_profile', methods=['GET'])
+def load_profile(sheet_id=DEFAULT_SHEET):
+  sheet = get_sheet(sheet_id)
+  if is_bonspiel_locked(sheet.state.snapshot.config):
     return jsonify({"error": "Cannot update config while timer is running in bonspiel mode"}), 400
 
   name = request.args.get('name')
@@ -352,8 +684,8 @@ def load_profile():
   if name not in profiles:
     return jsonify({"error": "Profile not found"}), 400
 
-  update_config_with_profile(name)
-  return jsonify({key: server_config[key].value for key in server_config}), 200
+  update_config_with_profile(sheet, name)
+  return config_response(sheet), 200
 
 @app.route('/get_profile_description', methods=['POST'])
 def get_profile_description():
@@ -368,60 +700,71 @@ def get_profile_description():
 
   return jsonify({"description": profiles[profile_name]["description"]}), 200
 
-@app.route('/messages', methods=['GET'])
-def get_messages():
-  global MESSAGES
-  output_messages = []
-  for message in MESSAGES:
-    output_messages.append(message)
-  MESSAGES = []
-  return jsonify({"messages": output_messages, "config": {key: server_config[key].value for key in server_config}}), 200
-
-@app.route('/broadcast', methods=["GET", "POST"])
-def broadcast_message():
-  global MESSAGES
+@sheet_route('/messages', methods=['GET'])
+def get_messages(sheet_id=DEFAULT_SHEET):
+  sheet = get_sheet(sheet_id)
+  output_messages = sheet.pop_messages()
+  snapshot = sheet.state.snapshot
+  times = timer_state.calc_times(snapshot.config, timestamp())
+  body = b'{"messages": ' + encode_json(output_messages) + b', "config": ' + encode_config(sheet, snapshot, times) + b'}'
+  etag = make_etag(config_key(snapshot, times))
+
+  # Messages are only sent once, so a response carrying them is never replaced by a 304
+  if output_messages:
+    response = json_response(body, snapshot.version)
+    response.set_etag(etag)
+    return response
+  return json_response(body, snapshot.version, etag)
+
+@sheet_route('/broadcast', methods=["GET", "POST"])
+def broadcast_message(sheet_id=DEFAULT_SHEET):
+  sheet = get_sheet(sheet_id)
   if request.method == "POST":
     message = request.form.get('message', "")
     if not message:
       return render_template('broadcast_message.html', error="No message provided"), 200
 
-    if server_config["is_timer_running"].value:
+    if timer_state.is_running(sheet.state.snapshot.config, timestamp()):
       return render_template('broadcast_message.html', error="Cannot broadcast message while timer is running"), 200
 
-    MESSAGES.append(message)
+    sheet.post_message(message)
 
   return render_template('broadcast_message.html'), 200
 
-@app.route('/cycle_profile', methods=['GET'])
-def cycle_profile():
-  global PROFILE_ID
+@sheet_route('/cycle_profile', methods=['GET'])
+def cycle_profile(sheet_id=DEFAULT_SHEET):
+  sheet = get_sheet(sheet_id)
 
   # If the timer is running, don't allow the profile to be cycled
-  if server_config["is_timer_running"].value:
+  if timer_state.is_running(sheet.state.snapshot.config, timestamp()):
     logger.warning("Cannot cycle profile while timer is running")
-    return jsonify({key: server_config[key].value for key in server_config}), 200
+    return config_response(sheet), 200
 
   profiles = load_profiles(DATABASE_PATH)
   profile_names = list(profiles.keys())
-  if PROFILE_ID >= len(profile_names):
-    PROFILE_ID = 0
+  if sheet.profile_id >= len(profile_names):
+    sheet.profile_id = 0
 
-  update_config_with_profile(profile_names[PROFILE_ID])
-  MESSAGES.append("Selected profile {}".format(profile_names[PROFILE_ID]))
-  PROFILE_ID += 1
-  return jsonify({key: server_config[key].value for key in server_config}), 200
+  update_config_with_profile(sheet, profile_names[sheet.profile_id])
+  sheet.post_message("Selected profile {}".format(profile_names[sheet.profile_id]))
+  sheet.profile_id += 1
+  return config_response(sheet), 200
 
-def update_config_with_profile(profile_name):
+def update_config_with_profile(sheet, profile_name):
   profiles = load_profiles(DATABASE_PATH)
   if profile_name not in profiles:
     return
 
-  for key in profiles[profile_name]:
+  with sheet.state.transaction() as config:
+    apply_profile(config, profiles[profile_name])
+
+def apply_profile(config, profile):
+  for key in profile:
     if key == "description":
       continue
-    server_config[key].value = profiles[profile_name][key]
+    config[key] = profile[key]
 
-def adjust_timer(direction, minutes):
+def adjust_timer(sheet, direction, minutes):
   if not minutes:
     return
 
@@ -430,34 +773,47 @@ def adjust_timer(direction, minutes):
   if (direction != "add" and direction != "subtract") or minutes <= 0:
     return
 
-  if direction == "add":
-    # We "add" minutes to the start time to simulate the game starting later, meaning more time left
-    server_config["start_timestamp"].value += minutes * 60
+  with sheet.state.transaction() as config:
+    if direction == "add":
+      # We "add" minutes to the start time to simulate the game starting later, meaning more time left
+      config["start_timestamp"] += minutes * 60
+
+      # Don't allow the start time to be later than the time on the clock. While counting
+      # in, the clock is held at the count in deadline.
+      timer_state.calc_transitions(config)
+      uptime = timer_state.calc_times(config, timestamp())["uptime"]
+      if uptime < 0:
+        config["start_timestamp"] += uptime
+    else:
+      # We "subtract" minutes from the start time to simulate the game starting earlier, meaning less time left
+      config["start_timestamp"] -= minutes * 60
+      timer_state.calc_transitions(config)
+      times = timer_state.calc_times(config, timestamp())
+      uptime = times["uptime"]
+      game_time = times["total_time"] - uptime if config["count_direction"] < 0 else uptime
 
-    # Don't allow the start time to be in the future
-    if server_config["start_timestamp"].value > timestamp():
-      server_config["start_timestamp"].value = timestamp()
-  else:
-    # We "subtract" minutes from the start time to simulate the game starting earlier, meaning less time left
-    server_config["start_timestamp"].value -= minutes * 60
-    response, status = get_times()
-    times = response.json.get("times")
-    uptime = times["uptime"]
-    game_time = times["total_time"] - uptime if server_config["count_direction"].value < 0 else uptime
+      # If the adjusted time makes the game longer than it can be, adjust it back
+      if game_time > config["time_per_end"] * config["num_ends"]:
+        config["start_timestamp"] += minutes * 60
 
-    # If the adjusted time makes the game longer than it can be, adjust it back
-    if game_time > server_config["time_per_end"].value * server_config["num_ends"].value:
-      server_config["start_timestamp"].value += minutes * 60
+    # A paused timer picks up from the adjusted time when it is started again
+    if not config["is_timer_running"]:
+      config["timer_stop_uptime"] = config["stop_timestamp"] - config["start_timestamp"]
 
-  return jsonify({"start_timestamp": server_config["start_timestamp"].value}), 200
+  return jsonify({"start_timestamp": config["start_timestamp"]}), 200
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
   parser.add_argument("--host", default="0.0.0.0", help="host IP to bind to")
   parser.add_argument("--port", default="5000", type=int, help="port for server to listen on")
+  parser.add_argument("--threads", default=24, type=int, help="number of worker threads; each display using /stream holds one")
+  parser.add_argument("--sheets", nargs="*", default=[], help="names of additional sheets served under /sheets/<name>")
   args = parser.parse_args()
 
+  for name in args.sheets:
+    add_sheet(name)
+
   if USING_WAITRESS:
-    waitress.serve(app, host='0.0.0.0', port=args.port)
+    waitress.serve(app, host='0.0.0.0', port=args.port, threads=args.threads)
   else:
     app.run(port=args.port)
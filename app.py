@@ -14,6 +14,24 @@ import logging
 import json
 import queue
 import functools
+import heapq
+import itertools
+import math
+import threading
+import timer_state
+
+try:
+  USING_INOTIFY = True
+  import inotify_simple
+except ImportError:
+  USING_INOTIFY = False
+
+try:
+  USING_NUMPY = True
+  import numpy as np
+except ImportError:
+  USING_NUMPY = False
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('curling_timer')
 logger.setLevel(logging.INFO)
@@ -22,17 +40,32 @@ BASE_PATH = os.path.dirname(os.path.abspath(__file__))
 
 HOST_IP = None
 SERVER_PORT = None
+SHEET = None
 SERVER_PROCESS = None
 CONFIG_UPDATE_TIME_LIMIT = 30
 MESSAGE_TIME_LIMIT = 10
 MESSAGE_CHR_SOFT_LIMIT = 18
 MESSAGE_CHR_HARD_LIMIT = 28
 MESSAGE_LINE_LIMIT = 4
+RECONNECT_LIMIT = 30
+REQUEST_TIMEOUT = 5
+# The server sends a keep-alive every 15 seconds, so a stream that is silent for
+# longer than this has dropped
+STREAM_READ_TIMEOUT = 30
+TIME_SYNC_SAMPLES = 8
+FONT_CACHE_SIZE = 32
+STYLES_POLL_INTERVAL = 1
+ANIMATION_FPS = 10
+TICK_MARGIN = 0.005
 WARNING_END_PERCENT = 0.334
 Color = None
 
-def timestamp():
-  return datetime.datetime.now().timestamp()
+def api_url(route):
+  '''
+  URL of a route on the backend server for the sheet shown by this display
+  '''
+  prefix = "" if SHEET is None else "/sheets/{:s}".format(SHEET)
+  return 'http://{:s}:{:s}{:s}/{:s}'.format(HOST_IP, SERVER_PORT, prefix, route)
 
 def color_factory(colors=None):
   if colors is None:
@@ -77,6 +110,98 @@ def color_factory(colors=None):
 
   return Color
 
+# Styles compiled for rendering. colors is the Color enum built from the styles.
+Palette = collections.namedtuple("Palette", ["styles", "colors"])
+
+def compile_palette(styles):
+  return Palette(styles, color_factory(styles["colors"]))
+
+def read_palette(path):
+  '''
+  Read a styles file and compile it into a palette
+  '''
+  with open(path, "r") as f:
+    styles = json.load(f)
+  styles["colors"] = {k: tuple(v) for k,v in styles["colors"].items()}
+  return compile_palette(styles)
+
+class StyleWatcher:
+  '''
+  Watch a styles file on a background thread, and pass a new palette to callback
+  when it changes. The admin page changes the styles by swapping the user_styles.json
+  symlink, so both the link and the file it points to are checked. Changes are noticed
+  through inotify where it is available, otherwise every STYLES_POLL_INTERVAL seconds.
+  '''
+  def __init__(self, path, callback):
+    self.path = path
+    self.callback = callback
+    self.signature = self.get_signature()
+
+  def get_signature(self):
+    try:
+      link = os.lstat(self.path)
+      target = os.stat(self.path)
+    except OSError:
+      return None
+    return (link.st_ino, link.st_mtime_ns, target.st_ino, target.st_mtime_ns, target.st_size)
+
+  def start(self):
+    threading.Thread(target=self.watch, daemon=True).start()
+
+  def watch(self):
+    inotify = None
+    if USING_INOTIFY:
+      try:
+        inotify = inotify_simple.INotify()
+        self.add_watches(inotify)
+      except OSError as e:
+        logger.warning("Could not watch styles with inotify, checking every {:d}s: {}".format(STYLES_POLL_INTERVAL, e))
+        inotify = None
+
+    while True:
+      if inotify is not None:
+        # Events only say that something changed in the folders, check() tells if it was the styles
+        inotify.read()
+      else:
+        time.sleep(STYLES_POLL_INTERVAL)
+
+      if self.check() and inotify is not None:
+        # The link may point to a file in another folder now
+        self.add_watches(inotify)
+
+  def add_watches(self, inotify):
+    flags = inotify_simple.flags
+    mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE
+    for folder in {os.path.dirname(self.path), os.path.dirname(os.path.realpath(self.path))}:
+      inotify.add_watch(folder, mask)
+
+  def check(self):
+    '''
+    Compile the styles again if the file changed. Returns True if it changed.
+    '''
+    signature = self.get_signature()
+    if signature == self.signature:
+      return False
+
+    # A file that can't be read is tried again when it changes next
+    self.signature = signature
+    try:
+      palette = read_palette(self.path)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+      logger.warning("Could not read styles from {:s}: {}".format(self.path, e))
+      return True
+
+    self.callback(palette)
+    return True
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(path, size):
+  '''
+  Load a font at a size in pixels. Fonts are shared by every clock in the process,
+  so resizing the screen or rendering another preview does not parse the file again.
+  '''
+  return pygame.font.Font(path, size)
+
 @functools.cache
 def load_default_styles():
   # Read styles from the default file
@@ -85,14 +210,242 @@ def load_default_styles():
     default_styles["colors"] = {k: tuple(v) for k,v in default_styles["colors"].items()}
   return default_styles
 
+def wrap_message(text):
+  '''
+  Split a message into the lines shown on the screen
+  '''
+  output_lines = []
+  line_buf = ""
+  for c in text[0:MESSAGE_CHR_HARD_LIMIT*MESSAGE_LINE_LIMIT - 3]:
+    if c == "\r":
+      continue
+
+    if c == "\n":
+      output_lines.append(line_buf)
+      line_buf = ""
+      continue
+
+    if len(line_buf) > MESSAGE_CHR_HARD_LIMIT:
+      line_buf += "-"
+      output_lines.append(line_buf)
+      line_buf = c
+      continue
+
+    if len(line_buf) >= MESSAGE_CHR_SOFT_LIMIT and c == " ":
+      output_lines.append(line_buf)
+      line_buf = ""
+      continue
+
+    line_buf += c
+
+  # Add the last line to the output. If the message was truncated, then
+  # add an ellipsis to the end of the line
+  if len(text) > MESSAGE_CHR_HARD_LIMIT*MESSAGE_LINE_LIMIT-3:
+    line_buf += "..."
+
+  if len(output_lines) < MESSAGE_LINE_LIMIT:
+    output_lines.append(line_buf)
+  else:
+    output_lines[-1] = "{:s}...".format(output_lines[-1][:MESSAGE_CHR_HARD_LIMIT-3])
+  return output_lines
+
+class Message:
+  '''
+  A broadcast message, wrapped into lines when it arrives. The lines are rendered
+  once for each font and color they are shown in.
+  '''
+  __slots__ = ("lines", "rendered")
+
+  def __init__(self, text):
+    self.lines = wrap_message(text)
+    self.rendered = {}
+
+  def render(self, font, color):
+    key = (font, color)
+    if key not in self.rendered:
+      self.rendered[key] = [font.render(line, True, color) for line in self.lines]
+    return self.rendered[key]
+
+class RoleMap:
+  '''
+  A rendered frame with each pixel tagged by the colors of the styles it is drawn in,
+  so that it can be drawn again in other colors without rendering it. Each pixel is
+  one color, except at the anti-aliased edges of text, where the text color is
+  blended over another color with partial coverage.
+  '''
+  # Colors that text is drawn in
+  TEXT_ROLES = ("TEXT", "TEXT_WARNING_1", "TEXT_WARNING_2", "OT")
+
+  def __init__(self, roles, base, edges, edge_roles, coverage):
+    # roles are the names of the colors, in the order of the palette of base
+    self.roles = roles
+    self.base = base
+    self.edges = edges
+    self.edge_roles = edge_roles
+    self.coverage = coverage
+
+  @classmethod
+  def from_edges(cls, roles, index, edges, weights):
+    '''
+    Build a role map from the index of the color of each pixel of the frame, by row,
+    and the weight of each color out of 255 in the pixels at edges. Returns None if
+    an edge mixes more than two colors.
+    '''
+    if np.any(np.count_nonzero(weights, axis=1) > 2):
+      return None
+
+    # At the edges, the text is blended over the base color. The weight of the text
+    # color is the coverage it was blended with.
+    order = np.argsort(weights, axis=1)
+    first = order[:, -1]
+    second = order[:, -2]
+    is_text = np.isin(np.arange(len(roles)), [roles.index(role) for role in cls.TEXT_ROLES if role in roles])
+    text_first = is_text[first] & ~is_text[second]
+    base = index.copy()
+    base[edges] = np.where(text_first, second, first)
+    text = np.where(text_first, first, second)
+    coverage = weights[np.arange(len(text)), text].astype(np.int32)
+
+    # surfarray indexes the pixels by column
+    base_surface = pygame.Surface(base.shape[::-1], 0, 8)
+    pygame.surfarray.blit_array(base_surface, base.T.astype(np.uint8))
+    return cls(roles, base_surface, edges[::-1], text, coverage)
+
+  def render(self, palette, surface):
+    '''
+    Draw the frame in the colors of palette on surface
+    '''
+    colors = [palette.colors[role].value for role in self.roles]
+    self.base.set_palette(colors)
+    surface.blit(self.base, (0, 0))
+
+    # Blend the text at the edges the same way pygame blits text
+    colors = np.array(colors, dtype=np.int32)
+    base_colors = colors[pygame.surfarray.pixels2d(self.base)[self.edges]]
+    text_colors = colors[self.edge_roles]
+    pixels = pygame.surfarray.pixels3d(surface)
+    pixels[self.edges] = base_colors + (((text_colors - base_colors) * self.coverage[:, None] + text_colors) >> 8)
+    del pixels
+
+class TextAtlas:
+  '''
+  Rendered text for one font, kept per color. Labels are rendered once as whole
+  strings. Times change every second, so they are composed from cached glyphs
+  instead: JetBrains Mono is monospaced, so each glyph of a time fills one advance
+  and the result is the same as rendering the whole string.
+  '''
+  TIME_CHARACTERS = "0123456789:"
+
+  def __init__(self, font):
+    self.font = font
+    self.labels = {}
+    self.glyphs = {}
+
+  def render(self, text, color):
+    key = (text, color)
+    if key not in self.labels:
+      self.labels[key] = self.font.render(text, True, color)
+    return self.labels[key]
+
+  def get_glyphs(self, color):
+    if color not in self.glyphs:
+      glyphs = {c: self.font.render(c, True, color) for c in "0123456789"}
+
+      # The font draws a colon between two digits differently from a colon on its
+      # own, so cut it out of a rendered time
+      advance, height = glyphs["0"].get_size()
+      context = self.font.render("0:0", True, color)
+      glyphs[":"] = context.subsurface((advance, 0, advance, height)).copy()
+      self.glyphs[color] = glyphs
+    return self.glyphs[color]
+
+  def blit_time(self, surface, text, color, center):
+    '''
+    Draw a time such as 01:15:00 centered on center. surface can be anything
+    with the blit() method of a pygame Surface.
+    '''
+    if not all(c in self.TIME_CHARACTERS for c in text):
+      # Negative times are rare, and not worth caching every second of
+      text = self.font.render(text, True, color)
+      surface.blit(text, text.get_rect(center=center))
+      return
+
+    glyphs = self.get_glyphs(color)
+    advance, height = glyphs["0"].get_size()
+    rect = pygame.Rect(0, 0, advance*len(text), height)
+    rect.center = center
+    for i, c in enumerate(text):
+      surface.blit(glyphs[c], (rect.x + i*advance, rect.y))
+
+class Layout:
+  '''
+  Positions of the elements of the clock for one screen size, game type and number
+  of stones per end. Text positions are the centers of the text.
+  '''
+  __slots__ = ("center", "timer", "detail", "count_in", "end_number", "end_total", "overtime",
+               "message_y", "message_line_offset", "progress_labels",
+               "bar_x", "bar_y", "bar_x_offset", "bar_width", "bar_height", "section_height")
+
+  def __init__(self, width, height, game_type, stones_per_end):
+    cx, cy = width//2, height//2
+    self.center = (cx, cy)
+    self.timer = (cx, cy + 3*height // 32)
+    if game_type != "bonspiel":
+      self.detail = (cx, cy + 11*height // 32)
+    else:
+      self.detail = (cx, cy + 4*height // 16)
+    self.count_in = (cx, cy - 3*height // 16)
+    self.end_number = (cx - 2*width // 32, cy - 5*height // 16)
+    self.end_total = (cx + 2*width // 32, cy - 5*height // 16)
+    self.overtime = (cx, cy - 3*height // 16)
+
+    # Line i of a message with n lines is centered at message_y + (i - n + 2)*message_line_offset
+    self.message_y = cy + 4*height // 16
+    self.message_line_offset = height // 8
+    self.progress_labels = (cy + 7.3*height // 16, cy + 7.7*height // 16)
+
+    # The bar height is rounded down to a whole number of stone sections
+    self.bar_width = width // 12
+    self.section_height = (7*height // 8) // stones_per_end
+    self.bar_height = self.section_height * stones_per_end
+    self.bar_x_offset = 13*width // 30
+    self.bar_x = ((width - self.bar_width) // 2 - self.bar_x_offset,
+                  (width - self.bar_width) // 2 + self.bar_x_offset)
+    self.bar_y = (height - self.bar_height)//2
+
 class IceClock:
-  def __init__(self, width=1280, height=720, fullscreen=False, styles_path=None, styles=None, jestermode=False, headless=False):
+  def __init__(self, width=1280, height=720, fullscreen=False, styles_path=None, styles=None, jestermode=False, headless=False, use_stream=False):
     # Initialize Pygame
     pygame.init()
     pygame.mixer.init()
 
-    # Initialize message stack
+    # Initialize message stack. Messages are shown newest first, and taken down in
+    # the order of their deadlines.
     self._messages = []
+    self._message_deadlines = []
+    self._message_count = itertools.count()
+
+    # The latest game_times frame and any new messages are handed from the network
+    # thread to the render loop through these
+    self.use_stream = use_stream
+    self._latest_frame = None
+    self._frame_lock = threading.Lock()
+    self._fetched_version = None
+    self._incoming_messages = queue.Queue()
+    self._frame_ready = threading.Event()
+
+    # State used to extrapolate the timer locally between fetches of /game_times
+    self._state_version = None
+    self._clock_offset = 0
+    self._server_epoch = None
+    self._sync_samples = collections.deque(maxlen=TIME_SYNC_SAMPLES)
+
+    # Last payload of each route of the REST API, with the ETag it was sent with
+    self._payloads = {}
+    self._fetched_message_id = 0
+
+    # Every request goes through one session, which keeps its connections to the server open
+    self.session = requests.Session()
 
     # Setup the dimensions for window mode and full-screen mode
     # We need to do this before setting up the window so that we
@@ -138,7 +491,10 @@ class IceClock:
       except OSError:
         self.styles_path = os.path.join(styles_folder_path, "default_styles.json")
 
-    self.last_read_styles = None
+    # The style watcher hands over a new palette in a single assignment. The render
+    # thread switches to it at the start of the next frame.
+    self._palette = self.load_palette()
+    self._applied_palette = None
     self.update_styles()
 
     # Initialize UI elements
@@ -155,7 +511,7 @@ class IceClock:
 
   def create_font(self, numerator, denominator):
     jetbrains = os.path.join(BASE_PATH, "ttf", "JetBrainsMono-Medium.ttf")
-    return pygame.font.Font(jetbrains, numerator*self.height // denominator)
+    return load_font(jetbrains, numerator*self.height // denominator)
 
   def init_UI(self):
     '''
@@ -174,46 +530,94 @@ class IceClock:
     self.fonts["messages"] = self.create_font(3, 32)
     self.fonts["count_in"] = self.create_font(4, 16)
 
-  def update_styles(self):
-    global Color
+    # Rendered text is cached per font, so it has to be rendered again for new fonts
+    self.atlases = {}
+
+    # Images of the progress bars, drawn again when the screen size changes
+    self._bar_layers = None
+    self._layout = None
+
+    # Blits of the frame being rendered, and of the frame on the screen. Without
+    # a frame on the screen, the next frame is drawn in full.
+    self._frame = []
+    self._drawn_frame = None
+
+  def atlas(self, font_name):
+    if font_name not in self.atlases:
+      self.atlases[font_name] = TextAtlas(self.fonts[font_name])
+    return self.atlases[font_name]
 
+  def load_palette(self):
     # Use the styles provided if they are not None
     # This condition is only used by the style previewer
     if self.styles is not None and self.headless:
-      Color = color_factory(self.styles["colors"])
-      return
+      return compile_palette(self.styles)
 
     # Use default styles if no styles file is provided
     if self.styles_path is None:
-      Color = color_factory({})
-      return
+      return Palette(self.styles, color_factory({}))
+
+    return read_palette(self.styles_path)
+
+  def set_palette(self, palette):
+    '''
+    Hand a new palette to the render thread. Called by the style watcher, and by
+    the style previewer to reuse a clock for other styles.
+    '''
+    self._palette = palette
+    self._frame_ready.set()
 
-    # Check if the styles file has been updated since last read
-    stat_info = os.lstat(self.styles_path)
-    if (self.last_read_styles is not None and
-          (stat_info.st_ctime <= self.last_read_styles or
-           stat_info.st_mtime <= self.last_read_styles)):
+  def update_styles(self):
+    global Color
+    palette = self._palette
+    Color = palette.colors
+    if palette is self._applied_palette:
       return
 
-    # Read the styles from the file
-    with open(self.styles_path, "r") as f:
-      self.styles = json.load(f)
-      self.styles["colors"] = {k: tuple(v) for k,v in self.styles["colors"].items()}
-    self.last_read_styles = os.path.getmtime(self.styles_path)
-    Color = color_factory(self.styles["colors"])
+    self._applied_palette = palette
+    self.styles = palette.styles
+
+    # Drop the text rendered in the old colors, and draw the next frame in full
+    self.atlases = {}
+    self._drawn_frame = None
 
   @property
-  def center(self):
-    return {"x": self.width//2, "y": self.height//2}
+  def layout(self):
+    '''
+    Positions of the elements for the current screen size and configuration,
+    computed again only when one of them changes
+    '''
+    key = (self.width, self.height, self._server_config["game_type"], self._server_config["stones_per_end"])
+    if self._layout is None or self._layout[0] != key:
+      self._layout = (key, Layout(*key))
+    return self._layout[1]
 
   @property
   def config(self):
-    try:
-      response = requests.get('http://{:s}:{:s}/config'.format(HOST_IP, SERVER_PORT))
-    except Exception as e:
-      return f"Error: {e}"
+    '''
+    Latest configuration received from the server
+    '''
+    return self._server_config
+
+  def get_json(self, route):
+    '''
+    Get a JSON payload from the REST API. The server answers 304 Not Modified when
+    nothing changed since the last request, and the last payload is reused.
+    Returns the payload and whether it is new.
+    '''
+    headers = {}
+    cached = self._payloads.get(route)
+    if cached is not None:
+      headers["If-None-Match"] = cached[0]
+
+    response = self.session.get(api_url(route), headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304 and cached is not None:
+      return cached[1], False
 
-    return response.json()
+    data = response.json()
+    if "ETag" in response.headers:
+      self._payloads[route] = (response.headers["ETag"], data)
+    return data, True
 
   @property
   def total_time(self):
@@ -260,27 +664,96 @@ class IceClock:
 
     return -1
 
-  def update_time(self):
+  def sync_time(self):
     '''
-    Get the latest game time information through the REST API
-    Setup the app object so that we can render the information
+    Estimate the offset between the local monotonic clock and the server clock, NTP-style.
+    Returns the /time_sync payload, or None if the server could not be reached.
     '''
-
+    t0 = time.monotonic()
     try:
-      response = requests.get('http://{:s}:{:s}/game_times'.format(HOST_IP, SERVER_PORT))
+      response = self.session.get(api_url('time_sync'), timeout=REQUEST_TIMEOUT)
+      response.raise_for_status()
+      data = response.json()
+      server_epoch = data["server_time"] - data["monotonic"]
     except Exception as e:
-      return f"Error: {e}"
+      logger.warning("Could not sync time with server: {}".format(e))
+      return None
+    t3 = time.monotonic()
+
+    # If the wall clock of the server was stepped, the old samples no longer apply
+    if self._server_epoch is not None and abs(server_epoch - self._server_epoch) > 1:
+      self._sync_samples.clear()
+      self._fetched_version = None
+    self._server_epoch = server_epoch
+
+    # Assume the server read its clock halfway through the round trip. The sample
+    # with the shortest round trip has the smallest error.
+    self._sync_samples.append((t3 - t0, data["server_time"] - (t0 + t3)/2))
+    self._clock_offset = min(self._sync_samples)[1]
+
+    return data
+
+  def server_time(self):
+    '''
+    Current time on the server clock, as estimated by sync_time()
+    '''
+    return time.monotonic() + self._clock_offset
+
+  def is_animating(self):
+    # The OT text blinks
+    return bool(self._is_overtime)
 
-    times = response.json().get("times")
-    self._server_config = response.json().get("config")
+  def next_frame_time(self):
+    '''
+    Monotonic time at which the next frame is due. Frames are drawn just after each
+    whole second of the server clock, so the displayed seconds never skip, and at
+    ANIMATION_FPS while something on the screen animates. A message is taken down
+    as soon as it expires.
+    '''
+    now = time.monotonic()
+    deadline = math.floor(now + self._clock_offset) + 1 + TICK_MARGIN - self._clock_offset
+    if self.is_animating():
+      deadline = min(deadline, now + 1/ANIMATION_FPS)
+    if self._message_deadlines:
+      deadline = min(deadline, self._message_deadlines[0][0])
+    return deadline
 
+  def update_time(self):
+    '''
+    Setup the app object from the latest state received by the network thread,
+    so that we can render the information. Between updates, the times are
+    extrapolated locally from the last state. Never waits on the network.
+    '''
+    # Take the frame under the lock, so that one stored meanwhile is not dropped
+    with self._frame_lock:
+      frame, self._latest_frame = self._latest_frame, None
+    if frame is not None:
+      self.apply_game_times(frame)
+    elif self._state_version is not None:
+      times = timer_state.calc_times(self._server_config, self.server_time())
+      self._server_config = timer_state.effective_config(self._server_config, times)
+      self.apply_times(times)
+
+    while not self._incoming_messages.empty():
+      self.add_message(self._incoming_messages.get())
+    self.expire_messages()
+
+  def apply_game_times(self, data):
+    '''
+    Setup the app object from a /game_times payload so that we can render the information
+    '''
+    self._server_config = data.get("config")
+    self._state_version = data.get("state_version")
+    self.apply_times(data.get("times"))
+
+  def apply_times(self, times):
     self._end_number = times["end_number"]
     self._end_percentage = times["end_percentage"]
     self._is_overtime = times["is_overtime"]
     self._uptime = times["uptime"]
     self._total_time = times["total_time"]
 
-    if self.config["game_type"] == "bonspiel":
+    if self._server_config["game_type"] == "bonspiel":
       self._hours = times["hours"]
       self._minutes = times["minutes"]
       self._seconds = times["seconds"]
@@ -310,236 +783,290 @@ class IceClock:
     return color
 
   def render_club_logo(self):
-    self.screen.blit(self.image, self.image_rect)
+    self.blit(self.image, self.image_rect)
 
   def render_timer(self):
     color = self.get_text_color()
 
-    text = self.fonts["timer"].render("{:02d}:{:02d}:{:02d}".format(self._hours, self._minutes, self._seconds), True, color)
-    text_rect = text.get_rect(center=(self.center["x"], self.center["y"] + 3*self.height // 32))
-    self.screen.blit(text, text_rect)
+    text = "{:02d}:{:02d}:{:02d}".format(self._hours, self._minutes, self._seconds)
+    self.atlas("timer").blit_time(self, text, color, self.layout.timer)
 
   def render_detail_text(self):
     color = self.get_text_color()
 
     is_last_end = self._end_number >= self._server_config["num_ends"]
     if self._server_config["game_type"] == "bonspiel" and self._server_config["is_game_complete"]:
-      text = self.fonts["last_end"].render("GAME OVER", True, color)
+      text = self.atlas("last_end").render("GAME OVER", color)
     elif self._server_config["game_type"] == "bonspiel" and self._uptime >= self._server_config["time_to_chime"]:
-      text = self.fonts["last_end"].render("FINISH END +1", True, color)
+      text = self.atlas("last_end").render("FINISH END +1", color)
     elif self.warning_level == 2 and not self._server_config["game_type"] == "bonspiel" and not self._is_overtime:
       msg = "FINISH CURRENT END" if not self.jestermode else "FINNISH CURRENT END"
-      text = self.fonts["warning"].render(msg, True, color)
+      text = self.atlas("warning").render(msg, color)
     elif self.warning_level == 1 and not self._server_config["game_type"] == "bonspiel" and not self._is_overtime:
       msg = "PLAY {:d} CUTOFF".format(self._server_config["num_ends"]-1)
-      text = self.fonts["warning"].render(msg, True, color)
+      text = self.atlas("warning").render(msg, color)
     elif self._server_config["game_type"] != "bonspiel":
       msg = "PLAY {:d} CUTOFF".format(self._server_config["num_ends"])
-      text = self.fonts["last_end"].render(msg, True, color)
+      text = self.atlas("last_end").render(msg, color)
     elif self._is_overtime:
-      text = self.fonts["last_end"].render("OVERTIME", True, color)
+      text = self.atlas("last_end").render("OVERTIME", color)
     else:
-      text = self.fonts["last_end"].render("", True, color)
+      text = self.atlas("last_end").render("", color)
 
-    if self._server_config["game_type"] != "bonspiel":
-      text_rect = text.get_rect(center=(self.center["x"], self.center["y"] + 11*self.height // 32))
-    else:
-      text_rect = text.get_rect(center=(self.center["x"], self.center["y"] + 4*self.height // 16))
-    self.screen.blit(text, text_rect)
+    self.blit(text, text.get_rect(center=self.layout.detail))
 
   def render_count_in_warning(self):
     color = self.get_text_color()
-    text = self.fonts["count_in"].render("Starting in", True, color)
-    text_rect = text.get_rect(center=(self.center["x"], self.center["y"] - 3*self.height // 16))
-    self.screen.blit(text, text_rect)
+    text = self.atlas("count_in").render("Starting in", color)
+    text_rect = text.get_rect(center=self.layout.count_in)
+    self.blit(text, text_rect)
 
   def render_end_number(self):
     color = self.get_text_color()
 
     if not self._is_overtime:
       end_num = self._end_number if self._end_number < self._server_config["num_ends"] else self._server_config["num_ends"]
-      text = self.fonts["end_num_large"].render("{:d}".format(end_num), True, color)
-      text_rect = text.get_rect(center=(self.center["x"] - 2*self.width // 32, self.center["y"] - 5*self.height // 16))
+      text = self.atlas("end_num_large").render("{:d}".format(end_num), color)
+      text_rect = text.get_rect(center=self.layout.end_number)
       if self.jestermode:
         text = pygame.transform.flip(text, False, True)
-      self.screen.blit(text, text_rect)
+      self.blit(text, text_rect)
 
-      text = self.fonts["end_num_small"].render("/{:d}".format(self._server_config["num_ends"]), True, color)
-      text_rect = text.get_rect(center=(self.center["x"] + 2*self.width // 32, self.center["y"] - 5*self.height // 16))
+      text = self.atlas("end_num_small").render("/{:d}".format(self._server_config["num_ends"]), color)
+      text_rect = text.get_rect(center=self.layout.end_total)
       if self.jestermode:
         text = pygame.transform.flip(text, False, True)
-      self.screen.blit(text, text_rect)
+      self.blit(text, text_rect)
     else:
-      text = self.fonts["end_num_large"].render("OT", True, color)
+      text = self.atlas("end_num_large").render("OT", color)
       if self.jestermode:
         text = pygame.transform.flip(text, False, True)
-      text_rect = text.get_rect(center=(self.center["x"], self.center["y"] - 3*self.height // 16))
+      text_rect = text.get_rect(center=self.layout.overtime)
 
       # Blink the "OT" text on for one second and off for one second when over time
       if not self._is_overtime or self._seconds % 2:
         if self.jestermode:
           text = pygame.transform.flip(text, False, True)
-        self.screen.blit(text, text_rect)
+        self.blit(text, text_rect)
 
   def render_end_progress_bar(self):
     stones_per_end = self._server_config["stones_per_end"]
-
-    # Set up progress bar(s)
-    self.bar_width = self.width // 12
-    self.bar_height = 7*self.height // 8
-
-    # Calculate the height for each stone section then update the progress bar height
-    section_height = self.bar_height // stones_per_end
-    self.bar_height = section_height * stones_per_end
-
-    self.bar_x_offset = 13*self.width // 30
-    bar_x = ((self.width - self.bar_width) // 2 - self.bar_x_offset,
-             (self.width - self.bar_width) // 2 + self.bar_x_offset)
-
-    # Draw the border first, then the background
-    bar_bg_rects = [pygame.Rect(x, (self.height - self.bar_height)//2,
-                      self.bar_width, self.bar_height) for x in bar_x]
-    border = int(self.styles["parameters"]["bar_border_size"]/1000 * self.height)
-    bar_borders = [pygame.Rect(bg.x-border, bg.y-border,
-                                bg.width + 2*border, bg.height + 2*border) for bg in bar_bg_rects]
-    for rect in bar_borders:
-      pygame.draw.rect(self.screen, Color.BAR_BORDER.value, rect, border_radius=self.height // 50)
-
-    for rect in bar_bg_rects:
-      pygame.draw.rect(self.screen, Color.BAR_BG.value, rect, border_radius=self.height // 50)
+    layout = self.layout
 
     # Set the height of the progress bar
     # It is 1 - percentage so that the bar counts down instead of up
     # Round to an integer multiple of the number of stones per end
     percentage = int(stones_per_end * self._end_percentage) / stones_per_end
-    filled_height = int(self.bar_height * (1-percentage))
+    filled_height = int(layout.bar_height * (1-percentage))
     if self._is_overtime:
       # Timer is expired and overtime is allowed
-      filled_height = int(self.bar_height)
+      filled_height = int(layout.bar_height)
     elif self._end_number > self._server_config["num_ends"]:
       # Timer is expired, but overtime is not allowed
       filled_height = 0
+    filled_sections = min(filled_height // layout.section_height, stones_per_end)
+
+    # Draw the empty bar, then copy the filled sections over it from the full bar
+    empty, full, border = self.get_progress_bar_layers(stones_per_end, layout)
+    y = layout.bar_y - border
+    filled_top = border + layout.bar_height - filled_sections*layout.section_height
+    for x in layout.bar_x:
+      self.blit(empty, (x - border, y))
+      if filled_sections:
+        area = pygame.Rect(0, filled_top, full.get_width(), full.get_height() - filled_top)
+        self.blit(full, (x - border, y + filled_top), area)
+
+  def get_progress_bar_layers(self, stones_per_end, layout):
+    '''
+    Images of an empty and a full progress bar, including its border. They are
+    drawn again only when the stones per end, the screen size or the styles change,
+    so drawing a bar costs the same for any number of stones.
+    '''
+    parameters = self.styles["parameters"]
+    key = (stones_per_end, self.width, self.height, self.jestermode,
+           tuple(member.value for member in Color.__members__.values()),
+           parameters["bar_border_size"], parameters["divider_size"], parameters["color_every_nth"])
+    if self._bar_layers is not None and self._bar_layers[0] == key:
+      return self._bar_layers[1]
+
+    border = int(parameters["bar_border_size"]/1000 * self.height)
+    size = (layout.bar_width + 2*border, layout.bar_height + 2*border)
+    layers = []
+    for filled_sections in (0, stones_per_end):
+      layer = pygame.Surface(size, 0, self.screen)
+      layer.fill(Color.SCREEN_BG.value)
+      self.draw_progress_bar(layer, pygame.Rect(border, border, layout.bar_width, layout.bar_height),
+                             border, stones_per_end, layout.section_height, filled_sections)
+      layers.append(layer)
+
+    self._bar_layers = (key, (layers[0], layers[1], border))
+    return self._bar_layers[1]
+
+  def draw_progress_bar(self, surface, rect, border, stones_per_end, section_height, filled_sections):
+    # Draw the border first, then the background
+    bar_border = pygame.Rect(rect.x-border, rect.y-border, rect.width + 2*border, rect.height + 2*border)
+    pygame.draw.rect(surface, Color.BAR_BORDER.value, bar_border, border_radius=self.height // 50)
+    pygame.draw.rect(surface, Color.BAR_BG.value, rect, border_radius=self.height // 50)
 
     # Two colors for the stones represents two teams and more contrast for better visibility
     color1 = Color.BAR_FG1.value if not self.jestermode else (255, 0, 0)
     color2 = Color.BAR_FG2.value if not self.jestermode else (0, 255, 0)
 
-    is_doubles = self._server_config["stones_per_end"] == 5 or self._server_config["stones_per_end"] == 10
-
-    for rect in bar_bg_rects:
-      for i in range(stones_per_end):
-        section_rect = pygame.Rect(rect.x, rect.y + self.bar_height - (i + 1) * section_height,
-                                    self.bar_width, section_height)
-        # Alternate colors for each stone section
-        if not is_doubles:
-          color_mod = 2*self.styles["parameters"]["color_every_nth"]
-          color = color1 if i % color_mod < int(color_mod/2) else color2
-        else:
-          n = self._server_config["stones_per_end"]//5
-          color = color1 if i < n or i > self._server_config["stones_per_end"]-n-1 else color2
-
-        border_radius = self.height // 100 if i == 0 or i == stones_per_end - 1 else 0
-        if (i + 1) * section_height <= filled_height:
-          pygame.draw.rect(self.screen, color, section_rect, border_radius=border_radius)
-
-        # Add dividers to progress bars for each stone
-        if i:
-          divider_height = int(self.styles["parameters"]["divider_size"]/1000 * self.height)
-          stone_div = pygame.Rect(rect.x,
-                                  rect.y + self.bar_height - (i) * section_height - divider_height//2,
-                                  self.bar_width,
-                                  divider_height)
-          pygame.draw.rect(self.screen, Color.BAR_DIVIDER.value, stone_div)
+    is_doubles = stones_per_end == 5 or stones_per_end == 10
+    color_mod = 2*self.styles["parameters"]["color_every_nth"]
+    divider_height = int(self.styles["parameters"]["divider_size"]/1000 * self.height)
+
+    for i in range(stones_per_end):
+      section_rect = pygame.Rect(rect.x, rect.y + rect.height - (i + 1) * section_height,
+                                  rect.width, section_height)
+      # Alternate colors for each stone section
+      if not is_doubles:
+        color = color1 if i % color_mod < int(color_mod/2) else color2
+      else:
+        n = stones_per_end//5
+        color = color1 if i < n or i > stones_per_end-n-1 else color2
+
+      border_radius = self.height // 100 if i == 0 or i == stones_per_end - 1 else 0
+      if i < filled_sections:
+        pygame.draw.rect(surface, color, section_rect, border_radius=border_radius)
+
+      # Add dividers to progress bars for each stone
+      if i:
+        stone_div = pygame.Rect(rect.x,
+                                rect.y + rect.height - (i) * section_height - divider_height//2,
+                                rect.width,
+                                divider_height)
+        pygame.draw.rect(surface, Color.BAR_DIVIDER.value, stone_div)
 
   def render_end_progress_labels(self):
     color = self.get_text_color()
-    text = (self.fonts["end_progress_label"].render("STONES", True, color),
-            self.fonts["end_progress_label"].render("REMAINING", True, color))
+    text = (self.atlas("end_progress_label").render("STONES", color),
+            self.atlas("end_progress_label").render("REMAINING", color))
 
+    layout = self.layout
     side_signs = (-1, 1)
-    y_offsets = (self.center["y"] + 7.3*self.height // 16,
-                 self.center["y"] + 7.7*self.height // 16)
-
     for sgn in side_signs:
-      x_offset = (self.center["x"] + sgn*self.bar_x_offset)
+      x_offset = (layout.center[0] + sgn*layout.bar_x_offset)
 
-      for txt, y_offset in zip(text, y_offsets):
+      for txt, y_offset in zip(text, layout.progress_labels):
         text_rect = txt.get_rect(center=(x_offset, y_offset))
-        self.screen.blit(txt, text_rect)
+        self.blit(txt, text_rect)
 
   def render_messages(self):
-    # Render messages from the server
-
-    # Get the latest message and put it in the message queue
-    msg = self._messages[-1]
-    chr_queue = queue.Queue()
-    for c in msg[0][0:MESSAGE_CHR_HARD_LIMIT*MESSAGE_LINE_LIMIT - 3]:
-      chr_queue.put(c)
-
-    # Split the message into lines
-    output_lines = []
-    line_buf = ""
-    while not chr_queue.empty():
-      c = chr_queue.get()
-
-      if c == "\r":
-        continue
+    # Render the latest message from the server
+    message = self._messages[-1]
+    lines = message.render(self.fonts["messages"], self.get_text_color())
 
-      if c == "\n":
-        output_lines.append(line_buf)
-        line_buf = ""
-        continue
-
-      if len(line_buf) > MESSAGE_CHR_HARD_LIMIT:
-        line_buf += "-"
-        output_lines.append(line_buf)
-        line_buf = c
-        continue
-
-      if len(line_buf) >= MESSAGE_CHR_SOFT_LIMIT and c == " ":
-        output_lines.append(line_buf)
-        line_buf = ""
-        continue
+    layout = self.layout
+    for i, text in enumerate(lines):
+      text_rect = text.get_rect(center=(layout.center[0], layout.message_y + (i-len(lines)+2)*layout.message_line_offset))
+      self.blit(text, text_rect)
 
-      line_buf += c
+  def add_message(self, text):
+    '''
+    Lay out a new message, and schedule it to be taken down after MESSAGE_TIME_LIMIT seconds
+    '''
+    message = Message(text)
+    self._messages.append(message)
+    heapq.heappush(self._message_deadlines, (time.monotonic() + MESSAGE_TIME_LIMIT, next(self._message_count), message))
 
-    # Add the last line to the output. If the message was truncated, then
-    # add an ellipsis to the end of the line
-    if len(msg[0]) > MESSAGE_CHR_HARD_LIMIT*MESSAGE_LINE_LIMIT-3:
-      line_buf += "..."
+  def expire_messages(self):
+    now = time.monotonic()
+    while self._message_deadlines and self._message_deadlines[0][0] <= now:
+      _, _, message = heapq.heappop(self._message_deadlines)
+      self._messages.remove(message)
 
-    if len(output_lines) < MESSAGE_LINE_LIMIT:
-      output_lines.append(line_buf)
-    else:
-      output_lines[-1] = "{:s}...".format(output_lines[-1][:MESSAGE_CHR_HARD_LIMIT-3])
-    Nlines = len(output_lines)
+  def get_messages(self):
+    '''
+    Get the latest messages from the REST API and hand them to the render loop
+    '''
+    data, is_new = self.get_json('messages')
 
-    # Render the message to the screen
-    line_offset = self.height // 8
-    color = self.get_text_color()
-    for i, line in enumerate(output_lines):
-      text = self.fonts["messages"].render(line, True, color)
-      text_rect = text.get_rect(center=(self.center["x"], self.center["y"] + 4*self.height // 16 + (i-Nlines+2)*line_offset))
-      self.screen.blit(text, text_rect)
+    # A reused payload has no new messages; its messages were already shown
+    if not is_new:
+      return
 
-    # Filter the messages to remove old messages
-    self._messages = list(filter(lambda x: x[1] + MESSAGE_TIME_LIMIT > timestamp(), self._messages))
+    for msg in data.get("messages"):
+      self._incoming_messages.put(msg)
 
-  def get_messages(self):
+  def poll_updates(self):
     '''
-    Get the latest messages from the REST API
+    Poll the REST API once per second. Runs on its own thread. The full state is
+    only fetched when the server reports a new state version, and the messages
+    when it reports a new message, so an idle display makes one request per second.
+    Waits with an increasing delay while the server cannot be reached.
     '''
+    retry_delay = 1
+    while self.running:
+      try:
+        sync = self.sync_time()
+        if sync is None:
+          raise ConnectionError("No response from server")
+
+        if sync["message_id"] != self._fetched_message_id:
+          self.get_messages()
+          self._fetched_message_id = sync["message_id"]
+
+        if sync["state_version"] != self._fetched_version:
+          data, _ = self.get_json('game_times')
+          self._fetched_version = data["state_version"]
+          self.handle_update("game_times", data)
+        retry_delay = 1
+      except Exception as e:
+        logger.warning("Could not update from server: {}".format(e))
+        retry_delay = min(2*retry_delay, RECONNECT_LIMIT)
+        time.sleep(retry_delay)
+        continue
 
-    try:
-      response = requests.get('http://{:s}:{:s}/messages'.format(HOST_IP, SERVER_PORT))
-    except Exception as e:
-      return f"Error: {e}"
-
-    messages = response.json().get("messages")
-    self._server_config = response.json().get("config")
+      time.sleep(1)
 
-    for msg in messages:
-      self._messages.append((msg, timestamp()))
+  def stream_updates(self):
+    '''
+    Consume the /stream endpoint of the server. Runs on its own thread and
+    reconnects with an increasing delay if the connection drops.
+    '''
+    url = api_url('stream')
+    retry_delay = 1
+    while self.running:
+      try:
+        # The times are extrapolated locally between frames, which needs the server clock
+        self.sync_time()
+        with self.session.get(url, stream=True, timeout=(REQUEST_TIMEOUT, STREAM_READ_TIMEOUT)) as response:
+          response.raise_for_status()
+          retry_delay = 1
+          event = None
+          data = []
+          for line in response.iter_lines(decode_unicode=True):
+            if line:
+              field, _, value = line.partition(":")
+              if field == "event":
+                event = value.strip()
+              elif field == "data":
+                data.append(value.strip())
+              continue
+
+            # A blank line ends the event
+            if data:
+              self.handle_update(event, json.loads("\n".join(data)))
+            event = None
+            data = []
+      except Exception as e:
+        logger.warning("Lost connection to stream: {}".format(e))
+
+      time.sleep(retry_delay)
+      retry_delay = min(2*retry_delay, RECONNECT_LIMIT)
+
+  def handle_update(self, event, data):
+    '''
+    Hand an update received by the network thread to the render loop
+    '''
+    if event == "game_times":
+      with self._frame_lock:
+        self._latest_frame = data
+    elif event == "messages":
+      for msg in data["messages"]:
+        self._incoming_messages.put(msg)
+    self._frame_ready.set()
 
   def handle_chime(self):
     # If in bonspiel mode and play the chime if it is time to do so and has not
@@ -561,7 +1088,6 @@ class IceClock:
     '''
 
     self.update_styles()
-    self.screen.fill(Color.SCREEN_BG.value)
     if not self._server_config["count_in"]:
       self.render_end_progress_bar()
     #elf.render_end_progress_labels()
@@ -584,9 +1110,55 @@ class IceClock:
     else:
       self.render_count_in_warning()
 
+    self.draw_frame()
+
+  def blit(self, source, dest, area=None):
+    '''
+    Add a blit to the frame being rendered. Takes the same arguments as
+    pygame.Surface.blit; the screen is only drawn by draw_frame().
+    '''
+    size = area.size if area is not None else source.get_size()
+    self._frame.append((source, pygame.Rect((dest[0], dest[1]), size), area))
+
+  def draw_frame(self):
+    '''
+    Draw the rendered frame to the screen. Only the regions where its blits differ
+    from the frame already on the screen are drawn again and updated on the display.
+    The whole screen is drawn after a resize or a change of style.
+    '''
+    frame, self._frame = self._frame, []
+    background = Color.SCREEN_BG.value
+
+    # Blits are compared by their source surface, position and area. The frames keep
+    # their surfaces alive, so the id of a surface is not reused while it is compared.
+    keys = [(id(source), tuple(dest), tuple(area) if area is not None else None) for source, dest, area in frame]
+    drawn = self._drawn_frame
+    if (drawn is None or drawn["screen"] is not self.screen or drawn["background"] != background):
+      dirty = [self.screen.get_rect()]
+    else:
+      changed = collections.Counter(keys)
+      changed.subtract(drawn["keys"])
+      dirty = [pygame.Rect(key[1]) for key, count in changed.items() if count]
+
+      # The same blits in another order could overlap differently
+      if not dirty and keys != drawn["keys"]:
+        dirty = [self.screen.get_rect()]
+
+    for rect in dirty:
+      self.screen.set_clip(rect)
+      self.screen.fill(background)
+      for source, dest, area in frame:
+        if dest.colliderect(rect):
+          self.screen.blit(source, dest, area)
+    self.screen.set_clip(None)
+    self._drawn_frame = {"screen": self.screen, "background": background, "keys": keys, "blits": frame}
+
     # Update the display
-    if not self.headless:
-      pygame.display.flip()
+    if not self.headless and dirty:
+      if len(dirty) == 1 and dirty[0] == self.screen.get_rect():
+        pygame.display.flip()
+      else:
+        pygame.display.update(dirty)
 
   def key_down_callback(self, event):
     '''
@@ -596,7 +1168,7 @@ class IceClock:
     if event.key == pygame.K_r:
       # R key -- reset the timer
       logger.debug("User requested reset")
-      requests.get('http://{:s}:{:s}/reset'.format(HOST_IP, SERVER_PORT))
+      threading.Thread(target=self.session.get, args=(api_url('reset'),), kwargs={"timeout": REQUEST_TIMEOUT}, daemon=True).start()
       return
     elif event.key == pygame.K_q:
       # Q key -- quit the front end
@@ -624,6 +1196,61 @@ class IceClock:
         self.screen = pygame.display.set_mode((self.width, self.height))
       self.init_UI()
 
+  def render_role_map(self):
+    '''
+    Role map of the frame on the screen. The frame is rendered again with each
+    color of the styles drawn in its index, which tags the pixels of a single color,
+    then with the colors in turn set to full intensity in one channel and the others
+    black, which gives the weight of each color at the edges. Returns None if the
+    role map does not reproduce the frame in the current colors.
+    '''
+    if not USING_NUMPY:
+      return None
+
+    palette = self._palette
+    expected = self.screen_array()
+    roles = list(palette.colors.__members__)
+
+    def render_probe(colors):
+      self.set_palette(compile_palette(dict(palette.styles, colors=colors)))
+      self.render()
+      return self.screen_array()
+
+    index = render_probe({role: (i, i, i) for i, role in enumerate(roles)})[:, :, 0]
+    probes = []
+    for i in range(0, len(roles), 3):
+      colors = {role: (0, 0, 0) for role in roles}
+      for channel, role in enumerate(roles[i:i+3]):
+        colors[role] = tuple(255 if c == channel else 0 for c in range(3))
+      probes.append(render_probe(colors)[:, :, :len(roles[i:i+3])])
+
+    self.set_palette(palette)
+    self.render()
+
+    # A pixel is a single color if it is at full intensity in one of the probes
+    solid = np.zeros(index.shape, dtype=bool)
+    for probe in probes:
+      for channel in range(probe.shape[2]):
+        solid |= probe[:, :, channel] == 255
+    edges = np.nonzero(~solid)
+    weights = np.concatenate([probe[edges] for probe in probes], axis=1)
+
+    role_map = RoleMap.from_edges(roles, index, edges, weights)
+    if role_map is None:
+      return None
+
+    surface = pygame.Surface(self.screen.get_size(), 0, self.screen)
+    role_map.render(palette, surface)
+    if not np.array_equal(pygame.surfarray.pixels3d(surface), expected.transpose(1, 0, 2)):
+      return None
+    return role_map
+
+  def screen_array(self):
+    '''
+    Copy of the pixels on the screen by row, as an array of RGB values
+    '''
+    return np.frombuffer(pygame.image.tobytes(self.screen, "RGB"), np.uint8).reshape(self.height, self.width, 3)
+
   def render_to_image(self, output):
     if (self._hours is None or self._minutes is None or self._seconds is None
         or self._end_number is None or self._end_percentage is None or self._is_overtime is None):
@@ -639,7 +1266,22 @@ class IceClock:
     output.seek(0)
 
   def run(self):
-    # Main loop
+    '''
+    Main loop. The server is polled, or streams its updates if use_stream is set,
+    on a separate thread so that rendering and input never wait on the network.
+    '''
+    fetch_updates = self.stream_updates if self.use_stream else self.poll_updates
+    threading.Thread(target=fetch_updates, daemon=True).start()
+    if self.styles_path is not None:
+      StyleWatcher(self.styles_path, self.set_palette).start()
+
+    # Wait for the first frame so that there is something to render
+    while self.running and self._latest_frame is None:
+      for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+          self.teardown()
+      self._frame_ready.wait(0.1)
+
     while self.running:
       for event in pygame.event.get():
         if event.type == pygame.QUIT:
@@ -647,24 +1289,22 @@ class IceClock:
         if event.type == pygame.KEYDOWN:
           self.key_down_callback(event)
 
-      # If there are messages, then we can skip updating the time
-      if not self._messages:
-        self.update_time()
-
-      # Get the latest messages from the server and render all UI elements
+      # Render all UI elements
+      self._frame_ready.clear()
+      self.update_time()
       self.handle_chime()
-      self.get_messages()
       self.render()
 
-      # If there are messages, then update the UI more frequently. Otherwise,
-      # update once per second.
-      if not self._messages:
-        time.sleep(1)
+      # Sleep until the next frame is due, or until there is a new state or new
+      # styles to show
+      self._frame_ready.wait(max(0, self.next_frame_time() - time.monotonic()))
 
   def teardown(self):
     '''
     Exit the front end and cleanup as needed.
     '''
+    # Fonts can't be used once pygame quits
+    load_font.cache_clear()
     pygame.quit()
     sys.exit()
 
@@ -675,8 +1315,8 @@ def check_server():
   except requests.ConnectionError:
     return False
 
-def start_server(host="127.0.0.1", port="5000"):
-  return subprocess.Popen([sys.executable, 'api.py', "--host", host, "--port", port])
+def start_server(host="127.0.0.1", port="5000", sheets=()):
+  return subprocess.Popen([sys.executable, 'api.py', "--host", host, "--port", port, "--sheets", *sheets])
 
 if __name__ == "__main__":
   parser = argparse.ArgumentParser()
@@ -684,17 +1324,24 @@ if __name__ == "__main__":
   parser.add_argument("--port", default="5000", help="port that backend server is listening on")
   parser.add_argument("--full-screen", "-f", action="store_true", default=False, help="launch in full screen mode")
   parser.add_argument("--styles", "-s", default=None, help="path to JSON file with color styles")
+  parser.add_argument("--sheet", default=None, help="sheet of ice to display when the server runs more than one")
+  parser.add_argument("--stream", action="store_true", default=False, help="receive updates pushed by the server instead of polling")
+  parser.add_argument("--timeout", default=REQUEST_TIMEOUT, type=float, help="seconds to wait for a response from the server")
+  parser.add_argument("--fps", default=ANIMATION_FPS, type=float, help="frames per second while overtime is shown")
   parser.add_argument("-j", "--jester", action="store_true", help=argparse.SUPPRESS, required=False)
   args = parser.parse_args()
 
   # Set the variable based on the argument
   HOST_IP = args.host
   SERVER_PORT = args.port
+  SHEET = args.sheet
+  REQUEST_TIMEOUT = args.timeout
+  ANIMATION_FPS = args.fps
 
   # Start the server if it is not already running
   if not check_server():
     logger.info("Could not find backend server. Attempting to start backend server...")
-    SERVER_PROCESS = start_server(host=HOST_IP, port=SERVER_PORT)
+    SERVER_PROCESS = start_server(host=HOST_IP, port=SERVER_PORT, sheets=[SHEET] if SHEET else [])
     if check_server():
       logger.info("Started backend server successfully -- PID: {:d}".format(SERVER_PROCESS.pid))
     else:
@@ -702,5 +1349,5 @@ if __name__ == "__main__":
       sys.exit(1)
 
   # Start the front end
-  clock = IceClock(fullscreen=args.full_screen, styles_path=args.styles)
+  clock = IceClock(fullscreen=args.full_screen, styles_path=args.styles, use_stream=args.stream)
   clock.run()
@@ -0,0 +1,271 @@
+'''
+Style previews rendered in worker processes. Each worker has its own pygame and its
+own Color styles, so previews can be rendered at the same time, and rendering never
+holds up the threads of the server that answer the timer displays.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+import concurrent.futures
+import multiprocessing
+import threading
+import hashlib
+import time
+import json
+import io
+import timer_state
+
+RENDER_PROCESSES = 2
+RENDER_BACKLOG = 8
+RENDER_TIMEOUT = 10
+PREVIEW_CACHE_BYTES = 16*1024*1024
+ROLE_MAP_CACHE_SIZE = 16
+
+# Values of the server configuration that change how a preview looks
+PREVIEW_CONFIG_KEYS = ("game_type", "num_ends", "time_per_end", "stones_per_end", "count_direction",
+                       "allow_overtime", "count_in", "time_to_chime", "is_game_complete")
+
+# State of the clock in each scenario that a preview can show: the end it is in,
+# counted back from the last end if 0 or less, and how far through that end, or
+# else the seconds past the end of the game; changes to the configuration; and a
+# message to show. The OT text blinks off on even seconds of overtime.
+PREVIEW_SCENARIOS = {
+  "normal": {"end": 1, "percent": 0.25},
+  "warning_1": {"end": -1, "percent": 0.5},
+  "warning_2": {"end": 0, "percent": 0.5},
+  "overtime": {"overtime": 15, "config": {"game_type": "bonspiel", "time_to_chime": 6000, "allow_overtime": True}},
+  "count_in": {"end": 1, "percent": 0, "config": {"count_in": 10}},
+  "message": {"end": 2, "percent": 0.5, "message": "Hello World!"},
+  "bonspiel": {"end": 7, "percent": 0.5, "config": {"game_type": "bonspiel", "time_to_chime": 6000}},
+  "bonspiel_after_chime": {"end": 7, "percent": 0.75, "config": {"game_type": "bonspiel", "time_to_chime": 6000}},
+  "bonspiel_complete": {"end": 9, "percent": 0, "config": {"game_type": "bonspiel", "time_to_chime": 6000}},
+}
+
+class RenderQueueFull(Exception):
+  pass
+
+# Headless clock of a worker process, kept between previews so that pygame, the
+# fonts and the chime are only loaded once
+_clock = None
+
+# Role maps of the scenarios rendered by a worker process, by role_map_key. Previews
+# that only change the colors are drawn from these without rendering the clock.
+# Making one takes several renders, so it is only made when a scenario is rendered a
+# second time; until then the entry is False. None marks a frame that cannot be
+# drawn from a role map.
+_role_maps = OrderedDict()
+
+def get_clock(styles):
+  import app
+  global _clock
+  if _clock is None:
+    _clock = app.IceClock(headless=True, styles=styles)
+  else:
+    _clock.set_palette(app.compile_palette(styles))
+  return _clock
+
+def role_map_key(styles, config, name):
+  '''
+  Everything a preview depends on other than its colors
+  '''
+  values = {
+    "parameters": styles.get("parameters"),
+    "config": {key: config[key] for key in PREVIEW_CONFIG_KEYS},
+    "scenario": name,
+  }
+  return json.dumps(values, sort_keys=True, separators=(",", ":"))
+
+def render_cached_scenario(clock, styles, config, name):
+  '''
+  Render the named scenario from its role map if there is one, or else render it in
+  full. Returns the PNG image as bytes.
+  '''
+  import pygame
+  key = role_map_key(styles, config, name)
+  role_map = _role_maps.get(key)
+  if key in _role_maps:
+    _role_maps.move_to_end(key)
+
+  if role_map:
+    surface = pygame.Surface(clock.screen.get_size(), 0, clock.screen)
+    role_map.render(clock._palette, surface)
+    img_io = io.BytesIO()
+    pygame.image.save(surface, img_io, "PNG")
+    return img_io.getvalue()
+
+  image = render_scenario(clock, config, PREVIEW_SCENARIOS[name])
+  if role_map is False:
+    _role_maps[key] = clock.render_role_map()
+  elif key not in _role_maps:
+    _role_maps[key] = False
+    while len(_role_maps) > ROLE_MAP_CACHE_SIZE:
+      _role_maps.popitem(last=False)
+  return image
+
+def render_scenario(clock, config, scenario):
+  '''
+  Render one of PREVIEW_SCENARIOS, and return the PNG image as bytes
+  '''
+  config = dict(config)
+  config["count_in"] = 0
+  config.update(scenario.get("config", {}))
+  timer_state.calc_num_bonspiel_ends(config)
+
+  # Set up the timer as stopped after the uptime of the scenario, and show it the
+  # way a display would
+  if "overtime" in scenario:
+    uptime = timer_state.calc_total_time(config) + scenario["overtime"]
+  else:
+    end = scenario["end"] if scenario["end"] > 0 else config["num_ends"] + scenario["end"]
+    uptime = int(config["time_per_end"] * (end - 1 + scenario["percent"]))
+  config.update(is_timer_running=False, start_timestamp=0, stop_timestamp=uptime)
+  timer_state.calc_transitions(config)
+  times = timer_state.calc_times(config, uptime)
+  clock._server_config = timer_state.effective_config(config, times)
+  clock.apply_times(times)
+
+  clock._messages = []
+  clock._message_deadlines = []
+  if "message" in scenario:
+    clock.add_message(scenario["message"])
+
+  img_io = io.BytesIO()
+  clock.render_to_image(img_io)
+  return img_io.getvalue()
+
+def render_style_images(styles, config, scenarios):
+  '''
+  Render previews of styles for each of the named scenarios with the same clock.
+  Runs in a worker process, and returns the size of the images and the PNG image
+  of each scenario as bytes.
+  '''
+  clock = get_clock(styles)
+  images = {name: render_cached_scenario(clock, styles, config, name) for name in scenarios}
+  return (clock.width, clock.height), images
+
+def preview_key(styles, image_type, config, size):
+  '''
+  Hash of everything that a preview image depends on
+  '''
+  values = {
+    "styles": styles,
+    "image_type": image_type,
+    "config": {key: config[key] for key in PREVIEW_CONFIG_KEYS},
+    "size": size,
+  }
+  return hashlib.sha256(json.dumps(values, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+class PreviewCache:
+  '''
+  Rendered preview images by preview_key. The least recently used images are dropped
+  once the images take more than max_bytes.
+  '''
+  def __init__(self, max_bytes=PREVIEW_CACHE_BYTES):
+    self.max_bytes = max_bytes
+    self.size = 0
+    self.images = OrderedDict()
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      image = self.images.get(key)
+      if image is not None:
+        self.images.move_to_end(key)
+      return image
+
+  def put(self, key, image):
+    if len(image) > self.max_bytes:
+      return
+
+    with self.lock:
+      if key in self.images:
+        self.size -= len(self.images.pop(key))
+      self.images[key] = image
+      self.size += len(image)
+      while self.size > self.max_bytes:
+        _, dropped = self.images.popitem(last=False)
+        self.size -= len(dropped)
+
+class RenderService:
+  '''
+  Pool of worker processes fed through a queue. At most backlog previews are queued
+  or being rendered at a time; more are refused with RenderQueueFull rather than
+  left to pile up. The processes are only started when the first preview is asked for.
+  '''
+  def __init__(self, processes=RENDER_PROCESSES, backlog=RENDER_BACKLOG):
+    self.processes = processes
+    self.slots = threading.BoundedSemaphore(backlog)
+    self.lock = threading.Lock()
+    self.executor = None
+
+    # Size of the images rendered by the workers, known after the first preview
+    self.size = None
+
+  def get_executor(self):
+    with self.lock:
+      if self.executor is None:
+        # Forking a server with running threads is not safe, so the workers start fresh
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+      return self.executor
+
+  def submit(self, fn, *args):
+    if not self.slots.acquire(blocking=False):
+      raise RenderQueueFull()
+
+    try:
+      future = self.get_executor().submit(fn, *args)
+    except BrokenProcessPool:
+      # A worker died. Start new ones and try once more.
+      self.restart()
+      try:
+        future = self.get_executor().submit(fn, *args)
+      except BaseException:
+        self.slots.release()
+        raise
+    except BaseException:
+      self.slots.release()
+      raise
+
+    future.add_done_callback(lambda _: self.slots.release())
+    return future
+
+  def render(self, styles, config, scenarios, timeout=RENDER_TIMEOUT):
+    '''
+    Render previews of the named scenarios in a worker process, and return the PNG
+    image of each as bytes. Raises concurrent.futures.TimeoutError if they are not
+    done within timeout seconds, including the time spent in the queue.
+    '''
+    args = (styles, dict(config), list(scenarios))
+    deadline = time.monotonic() + timeout
+    future = self.submit(render_style_images, *args)
+    try:
+      try:
+        self.size, images = future.result(timeout=timeout)
+      except BrokenProcessPool:
+        # A worker died while rendering. Start new ones and try once more.
+        self.restart()
+        future = self.submit(render_style_images, *args)
+        self.size, images = future.result(timeout=max(0, deadline - time.monotonic()))
+      return images
+    except concurrent.futures.TimeoutError:
+      # Drop the preview if it has not started yet. One that has started still
+      # finishes, but nobody waits for it.
+      future.cancel()
+      raise
+
+  def restart(self):
+    '''
+    Start new worker processes after one died. Previews already queued on the old
+    ones still finish.
+    '''
+    with self.lock:
+      executor, self.executor = self.executor, None
+    if executor is not None:
+      executor.shutdown(wait=False)
+
+  def shutdown(self):
+    with self.lock:
+      executor, self.executor = self.executor, None
+    if executor is not None:
+      executor.shutdown(wait=False, cancel_futures=True)
@@ -1,22 +1,54 @@
-function get_style_img(inputData, img_node, header_node, header_txt) {
-    fetch('/style_img', {
+// Images already shown, by request. They are asked for again with their ETag so
+// that the server can answer that nothing changed instead of sending them again.
+const styleImgCache = new Map();
+
+function get_style_imgs(inputData, previews) {
+    // All the previews are rendered together, and returned as one multipart response
+    inputData["scenarios"] = previews.map(preview => preview.scenario);
+    const body = JSON.stringify(inputData);
+    const cached = styleImgCache.get(body);
+    const headers = {
+        'Content-Type': 'application/json',
+    };
+    if (cached) {
+        headers['If-None-Match'] = cached.etag;
+    }
+
+    fetch('/style_imgs', {
         method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(inputData),
+        headers: headers,
+        body: body,
     })
-    .then(response => response.blob())  // Get the image blob response
-    .then(imageBlob => {
-        // Create a URL for the image blob
-        const imageUrl = URL.createObjectURL(imageBlob);
+    .then(response => {
+        if (response.status === 304) {
+            return cached.urls;
+        }
+        if (!response.ok) {
+            throw new Error('Could not render the previews: ' + response.status);
+        }
 
-        // Show the generated image
-        img_node.src = imageUrl;
-        img_node.style.display = 'block';
+        // Create a URL for each of the images
+        return response.formData().then(formData => {
+            const imageUrls = {};
+            for (const preview of previews) {
+                imageUrls[preview.scenario] = URL.createObjectURL(formData.get(preview.scenario));
+            }
+            if (cached) {
+                Object.values(cached.urls).forEach(url => URL.revokeObjectURL(url));
+            }
+            styleImgCache.set(body, {etag: response.headers.get('ETag'), urls: imageUrls});
+            return imageUrls;
+        });
+    })
+    .then(imageUrls => {
+        for (const preview of previews) {
+            // Show the generated image
+            preview.img_node.src = imageUrls[preview.scenario];
+            preview.img_node.style.display = 'block';
 
-        // Set the header to have text now that there is an image
-        header_node.innerText = header_txt;
+            // Set the header to have text now that there is an image
+            preview.header_node.innerText = preview.header_txt;
+        }
     })
     .catch(error => console.error('Error:', error));
 }
@@ -24,29 +56,21 @@ function get_style_img(inputData, img_node, header_node, header_txt) {
 document.getElementById('preview_style_btn').addEventListener('click', function() {
     event.preventDefault();
 
-    // Collect form data
-    inputData = get_form_data();
-    inputData["image_settings"]["image_type"] = "normal";
-
-    // Send input data as JSON to the server to get the image for
-    // the normal style
-    get_style_img(inputData,
-                  document.getElementById('generated_image'),
-                  document.getElementById("normal_header"),
-                  "Normal style");
-
-    // Get the image for the first warning
-    inputData["image_settings"]["image_type"] = "warning_1";
-    get_style_img(inputData,
-                  document.getElementById('generated_image_warning_1'),
-                  document.getElementById("warning_1_header"),
-                  "Warning #1");
-
-    // Get the image for the second warning
-    inputData["image_settings"]["image_type"] = "warning_2";
-    get_style_img(inputData,
-                  document.getElementById('generated_image_warning_2'),
-                  document.getElementById("warning_2_header"),
-                  "Warning #2");
+    // Collect form data, and send it as JSON to the server to get the images for the
+    // normal style and both warnings
+    get_style_imgs(get_form_data(), [
+        {scenario: "normal",
+         img_node: document.getElementById('generated_image'),
+         header_node: document.getElementById("normal_header"),
+         header_txt: "Normal style"},
+        {scenario: "warning_1",
+         img_node: document.getElementById('generated_image_warning_1'),
+         header_node: document.getElementById("warning_1_header"),
+         header_txt: "Warning #1"},
+        {scenario: "warning_2",
+         img_node: document.getElementById('generated_image_warning_2'),
+         header_node: document.getElementById("warning_2_header"),
+         header_txt: "Warning #2"},
+    ]);
 }
-);
\ No newline at end of file
+);
@@ -1,5 +1,16 @@
 import unittest
-from api import app, server_config, timestamp
+import json
+import threading
+import sys
+import os
+import sqlite3
+import tempfile
+import time
+import email
+import signal
+import style_renderer
+from api import app, server_config, timestamp, add_sheet, SHEETS, read_styles, preview_config
+from admin import load_profiles, invalidate_profiles
 
 class CurlingTimerTestCase(unittest.TestCase):
   def setUp(self):
@@ -37,6 +48,33 @@ class CurlingTimerTestCase(unittest.TestCase):
     self.assertEqual(response.status_code, 500)
     self.assertEqual(response.json, {"error": "Key not found"})
 
+  def test_update_batch(self):
+    self.app.get('/reset')
+    version = self.app.get('/time_sync').json["state_version"]
+
+    # A batch with a bad entry changes nothing
+    response = self.app.post('/update', json={"values": {"stones_per_end": 6, "invalid_key": 1}})
+    self.assertEqual(response.status_code, 400)
+    response = self.app.post('/update', json={"values": {"stones_per_end": 6, "time_per_end": "abc"}})
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(self.app.get('/time_sync').json["state_version"], version)
+
+    # A valid batch is applied as a single change
+    values = {"game_type": "bonspiel", "time_per_end": 600, "time_to_chime": 6000, "stones_per_end": 6}
+    response = self.app.post('/update', json={"values": values})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json["stones_per_end"], 6)
+    self.assertEqual(response.json["num_ends"], 12)
+    self.assertEqual(self.app.get('/time_sync').json["state_version"], version + 1)
+
+    response = self.app.post('/update', json={"reset": True, "profile": "8ends", "values": {"game_type": "league"}, "start": True})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json["game_type"], "league")
+    self.assertEqual(response.json["num_ends"], 8)
+    self.assertEqual(response.json["stones_per_end"], 8)
+    self.assertTrue(response.json["is_timer_running"])
+    self.app.get('/reset')
+
   def test_start_timer(self):
     response = self.app.get('/start')
     self.assertEqual(response.status_code, 200)
@@ -67,5 +105,336 @@ class CurlingTimerTestCase(unittest.TestCase):
     for key in time_keys:
       self.assertIn(key, times)
 
+  def test_cached_payloads(self):
+    self.app.get('/reset')
+    first = self.app.get('/game_times')
+    version = first.json["state_version"]
+    self.assertEqual(first.headers["X-State-Version"], str(version))
+    self.assertEqual(self.app.get('/game_times').data, first.data)
+
+    # A change to the config is seen by every endpoint that returns it
+    self.app.get('/update?key=stones_per_end&value=6')
+    response = self.app.get('/config')
+    self.assertGreater(int(response.headers["X-State-Version"]), version)
+    self.assertEqual(response.json["stones_per_end"]["value"], 6)
+    self.assertEqual(self.app.get('/game_times').json["config"]["stones_per_end"], 6)
+    self.assertEqual(self.app.get('/messages').json["config"]["stones_per_end"], 6)
+    self.app.get('/update?key=stones_per_end&value=8')
+
+  def test_etag(self):
+    self.app.get('/reset')
+    for route in ['/config', '/game_times', '/messages']:
+      response = self.app.get(route)
+      etag = response.headers["ETag"]
+      self.assertEqual(self.app.get(route, headers={"If-None-Match": etag}).status_code, 304)
+
+      # Any change to the state changes the ETag
+      self.app.get('/update?key=stones_per_end&value=6')
+      response = self.app.get(route, headers={"If-None-Match": etag})
+      self.assertEqual(response.status_code, 200)
+      self.assertNotEqual(response.headers["ETag"], etag)
+      self.app.get('/update?key=stones_per_end&value=8')
+
+    # Messages are only delivered once
+    etag = self.app.get('/messages').headers["ETag"]
+    self.app.post('/broadcast', data={"message": "hello"})
+    response = self.app.get('/messages', headers={"If-None-Match": etag})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json["messages"], ["hello"])
+    self.assertEqual(self.app.get('/messages', headers={"If-None-Match": response.headers["ETag"]}).status_code, 304)
+
+  def test_profile_cache(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      db_path = os.path.join(tmp, "profiles.db")
+      profiles = load_profiles(db_path)
+      self.assertIs(load_profiles(db_path), profiles)
+
+      # A change committed by another connection is picked up
+      name = next(iter(profiles))
+      conn = sqlite3.connect(db_path)
+      conn.execute("DELETE FROM server_profiles WHERE name=?", (name,))
+      conn.commit()
+      conn.close()
+      self.assertNotIn(name, load_profiles(db_path))
+
+      invalidate_profiles(db_path)
+      self.assertIsNot(load_profiles(db_path), profiles)
+      invalidate_profiles(db_path)
+
+  def test_count_in(self):
+    self.app.get('/reset')
+    self.app.get('/update?key=count_in&value=30')
+    self.app.get('/start')
+
+    # The count in runs on the clock, no matter how often it is read
+    for _ in range(10):
+      times = self.app.get('/game_times').json["times"]
+      self.assertEqual(times["phase"], "count_in")
+      self.assertGreaterEqual(times["count_in"], 28)
+      self.assertEqual(times["uptime"], 0)
+
+    # Stopping keeps the rest of the count in for the next start
+    self.app.get('/stop')
+    times = self.app.get('/game_times').json["times"]
+    self.assertEqual(times["phase"], "idle")
+    self.assertGreaterEqual(times["count_in"], 28)
+
+    # Adjusting the time during the count in does not run the clock
+    self.app.get('/start')
+    self.app.post('/', data={"AdjustTimer": "", "adjust_minutes_dir": "add", "adjust_minutes": "1"})
+    times = self.app.get('/game_times').json["times"]
+    self.assertEqual(times["phase"], "count_in")
+    self.assertGreaterEqual(times["count_in"], 27)
+    self.assertEqual(times["uptime"], 0)
+    self.app.get('/reset')
+
+  def test_game_times_is_read_only(self):
+    self.app.get('/reset')
+    self.app.get('/start')
+    self.assertEqual(self.app.get('/game_times').json["times"]["phase"], "running")
+
+    # Move the start of the game back past its end
+    config = self.app.get('/game_times').json["config"]
+    league_time = config["time_per_end"] * config["num_ends"]
+    self.app.get('/update?key=start_timestamp&value={:d}'.format(int(timestamp()) - league_time - 10))
+
+    # Reading the finished game does not change the state
+    version = self.app.get('/time_sync').json["state_version"]
+    for _ in range(3):
+      data = self.app.get('/game_times').json
+      self.assertEqual(data["times"]["phase"], "complete")
+      self.assertEqual(data["times"]["uptime"], league_time)
+      self.assertTrue(data["config"]["is_game_complete"])
+      self.assertEqual(data["state_version"], version)
+
+    self.app.get('/reset')
+    self.assertEqual(self.app.get('/game_times').json["times"]["phase"], "idle")
+
+  def test_state_after_completion(self):
+    self.app.get('/reset')
+    self.app.get('/start')
+    config = self.app.get('/game_times').json["config"]
+    league_time = config["time_per_end"] * config["num_ends"]
+    self.app.get('/update?key=start_timestamp&value={:d}'.format(int(timestamp()) - league_time - 10))
+
+    # A completed game is reported as stopped, so that scheduled games can start
+    self.assertEqual(self.app.get('/config?key=is_timer_running').json, {"is_timer_running": False})
+    self.assertFalse(self.app.get('/game_times').json["config"]["is_timer_running"])
+
+    # Starting it again keeps it complete, at the end of the game
+    self.app.get('/start')
+    times = self.app.get('/game_times').json["times"]
+    self.assertEqual(times["phase"], "complete")
+    self.assertEqual(times["uptime"], league_time)
+
+    # and the next game starts from the beginning
+    self.assertEqual(self.app.post('/update', json={"reset": True, "start": True}).status_code, 200)
+    self.assertEqual(self.app.get('/game_times').json["times"]["phase"], "running")
+    self.assertTrue(self.app.get('/config?key=is_timer_running').json["is_timer_running"])
+    self.app.get('/reset')
+
+  def test_time_sync(self):
+    response = self.app.get('/time_sync')
+    self.assertEqual(response.status_code, 200)
+    for key in ("server_time", "monotonic", "state_version", "message_id"):
+      self.assertIn(key, response.json)
+
+    # Changing the timer state moves the state version
+    version = response.json["state_version"]
+    self.app.get('/start')
+    response = self.app.get('/time_sync')
+    self.assertGreater(response.json["state_version"], version)
+    self.assertEqual(self.app.get('/game_times').json["state_version"], response.json["state_version"])
+    self.app.get('/reset')
+
+    # Broadcasting a message moves the message id
+    message_id = self.app.get('/time_sync').json["message_id"]
+    self.app.post('/broadcast', data={"message": "hello"})
+    self.assertEqual(self.app.get('/time_sync').json["message_id"], message_id + 1)
+    self.app.get('/messages')
+
+  def test_style_img(self):
+    # Worker processes reuse their clock, and render the same image for the same styles
+    def style_img(style_name, image_type="warning_1"):
+      response = self.app.post('/style_img', json={"style_name": style_name, "image_settings": {"image_type": image_type}})
+      self.assertEqual(response.status_code, 200)
+      return response.data
+
+    first = style_img("default_styles")
+    self.assertNotEqual(style_img("rcc_styles", "normal"), first)
+    self.assertEqual(style_img("default_styles"), first)
+
+    response = self.app.post('/style_img', json={"style_name": "default_styles", "image_settings": {"image_type": "invalid"}})
+    self.assertEqual(response.status_code, 400)
+
+  def test_style_img_cache(self):
+    # Identical previews are served from the cache, and are not sent again for their ETag
+    request = {"style_name": "default_styles", "image_settings": {"image_type": "normal"}}
+    response = self.app.post('/style_img', json=request)
+    self.assertEqual(response.status_code, 200)
+    etag = response.headers["ETag"]
+    self.assertIn("no-cache", response.headers["Cache-Control"])
+
+    response = self.app.post('/style_img', json=request, headers={"If-None-Match": etag})
+    self.assertEqual(response.status_code, 304)
+
+    # Previews depend on the configuration of the timer
+    self.app.post('/update', json={"values": {"stones_per_end": 6}})
+    response = self.app.post('/style_img', json=request, headers={"If-None-Match": etag})
+    self.assertEqual(response.status_code, 200)
+    self.assertNotEqual(response.headers["ETag"], etag)
+    self.app.post('/update', json={"values": {"stones_per_end": 8}})
+
+    # including the direction the clock counts in
+    request["image_settings"]["image_type"] = "bonspiel"
+    response = self.app.post('/style_img', json=request)
+    self.app.post('/update', json={"values": {"count_direction": 1}})
+    counting_up = self.app.post('/style_img', json=request, headers={"If-None-Match": response.headers["ETag"]})
+    self.app.post('/update', json={"values": {"count_direction": -1}})
+    self.assertEqual(counting_up.status_code, 200)
+    self.assertNotEqual(counting_up.data, response.data)
+
+    cache = style_renderer.PreviewCache(max_bytes=10)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    cache.get("a")
+    cache.put("c", b"12345")
+    self.assertEqual(list(cache.images), ["a", "c"])
+    self.assertEqual(cache.size, 10)
+
+  def test_style_imgs(self):
+    # All the scenarios of a batch are returned as parts of a multipart response
+    scenarios = ["normal", "count_in", "overtime", "message", "bonspiel"]
+    response = self.app.post('/style_imgs', json={"style_name": "default_styles", "scenarios": scenarios})
+    self.assertEqual(response.status_code, 200)
+    message = email.message_from_bytes(b"Content-Type: " + response.headers["Content-Type"].encode() + b"\r\n\r\n" + response.data)
+    parts = {part.get_param("name", header="Content-Disposition"): part.get_payload(decode=True) for part in message.get_payload()}
+    self.assertEqual(list(parts), scenarios)
+    self.assertEqual(len(set(parts.values())), len(scenarios))
+
+    # and are the same images as previews of a single scenario
+    response = self.app.post('/style_img', json={"style_name": "default_styles", "image_settings": {"image_type": "count_in"}})
+    self.assertEqual(response.data, parts["count_in"])
+
+    response = self.app.post('/style_imgs', json={"style_name": "default_styles", "scenarios": ["invalid"]})
+    self.assertEqual(response.status_code, 400)
+
+  def test_render_backlog(self):
+    # Previews beyond the backlog are refused instead of queued
+    service = style_renderer.RenderService(processes=1, backlog=1)
+    try:
+      future = service.submit(time.sleep, 0.5)
+      with self.assertRaises(style_renderer.RenderQueueFull):
+        service.submit(time.sleep, 0)
+      future.result(timeout=30)
+    finally:
+      service.shutdown()
+
+  def test_render_worker_died(self):
+    # A preview whose worker dies is rendered again by new workers
+    service = style_renderer.RenderService(processes=1)
+    try:
+      def kill_workers():
+        for pid in list(service.executor._processes):
+          os.kill(pid, signal.SIGKILL)
+
+      killer = threading.Timer(0.5, kill_workers)
+      killer.start()
+      images = service.render(read_styles({"style_name": "default_styles"}), preview_config(), ["normal"], timeout=60)
+      killer.join()
+      self.assertTrue(images["normal"].startswith(b"\x89PNG"))
+    finally:
+      service.shutdown()
+
+  def test_sheets(self):
+    sheet = add_sheet("sheet_b")
+    response = self.app.get('/sheets')
+    self.assertEqual(response.status_code, 200)
+    self.assertIn("sheet_b", response.json["sheets"])
+
+    # Each sheet has its own timer and the unprefixed routes use the default sheet
+    self.app.get('/reset')
+    response = self.app.get('/sheets/sheet_b/start')
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(sheet.state.snapshot.config["is_timer_running"])
+    self.assertFalse(server_config["is_timer_running"].value)
+
+    response = self.app.get('/sheets/sheet_b/game_times')
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response.json["config"]["is_timer_running"])
+
+    response = self.app.get('/sheets/game_times')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(set(response.json["sheets"].keys()), set(SHEETS.keys()))
+    self.assertTrue(response.json["sheets"]["sheet_b"]["config"]["is_timer_running"])
+    self.assertFalse(response.json["sheets"]["default"]["config"]["is_timer_running"])
+
+    response = self.app.get('/sheets/no_such_sheet/start')
+    self.assertEqual(response.status_code, 404)
+    self.assertEqual(response.json, {"error": "Sheet not found"})
+
+  def test_concurrent_requests(self):
+    # Hammer the timer from several threads while others poll it. Every payload
+    # must come from a single consistent state.
+    self.app.get('/reset')
+    errors = []
+
+    # Switch threads as often as possible so that interleavings are likely
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    self.addCleanup(sys.setswitchinterval, switch_interval)
+
+    def write(route):
+      client = app.test_client()
+      for _ in range(200):
+        client.get(route)
+
+    def read():
+      client = app.test_client()
+      last_version = -1
+      for _ in range(200):
+        data = client.get('/game_times').json
+        config = data["config"]
+        if data["state_version"] < last_version:
+          errors.append("state version went backwards")
+        last_version = data["state_version"]
+        if data["times"]["uptime"] < 0:
+          errors.append("negative uptime: {}".format(data))
+        if (not config["is_timer_running"] and
+            config["stop_timestamp"] - config["start_timestamp"] != config["timer_stop_uptime"]):
+          errors.append("torn stop: {}".format(config))
+
+    threads = [threading.Thread(target=write, args=(route,)) for route in ('/start', '/stop', '/reset', '/reset?time=1000', '/start', '/stop')]
+    threads += [threading.Thread(target=read) for _ in range(5)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(errors, [])
+    self.app.get('/reset')
+
+  def test_stream(self):
+    self.app.get('/reset')
+    response = self.app.get('/stream', buffered=False)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.mimetype, "text/event-stream")
+
+    # The current state is sent as soon as the stream opens
+    frames = iter(response.response)
+    frame = next(frames).decode()
+    self.assertTrue(frame.startswith("event: game_times\n"))
+    data = json.loads(frame.split("data: ", 1)[1])
+    self.assertIn("times", data)
+    self.assertIn("config", data)
+
+    # Broadcasting a message pushes it to the stream
+    self.app.post('/broadcast', data={"message": "Hello stream"})
+    frame = next(frames).decode()
+    self.assertTrue(frame.startswith("event: messages\n"))
+    self.assertEqual(json.loads(frame.split("data: ", 1)[1]), {"messages": ["Hello stream"]})
+    response.close()
+    self.app.get('/messages')
+
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
@@ -1,14 +1,20 @@
 from api import server_config
 import app
+import timer_state
 
 import sys
 from PIL import Image
 from functools import wraps
 import numpy as np
+import pygame
 import unittest
 import io
+import math
+import time
+import tempfile
 import os
 import logging
+import requests
 
 logging.basicConfig()
 logger = logging.getLogger("test_app")
@@ -152,7 +158,7 @@ class TestIceClock(unittest.TestCase):
   def test_short_message(self, golden_path=None):
     end_num = 2
     end_percentage = 0.5
-    self.clock._messages.append(("Hello World!", app.timestamp()))
+    self.clock.add_message("Hello World!")
     img_io = render_app(self.clock, end_num, end_percentage)
     self.image_test(img_io, golden_path)
 
@@ -160,7 +166,7 @@ class TestIceClock(unittest.TestCase):
   def test_long_message(self, golden_path=None):
     end_num = 2
     end_percentage = 0.5
-    self.clock._messages.append(("This message will be truncated because it is too long! It is really very long. Who made this message so long?", app.timestamp()))
+    self.clock.add_message("This message will be truncated because it is too long! It is really very long. Who made this message so long?")
     img_io = render_app(self.clock, end_num, end_percentage)
     self.image_test(img_io, golden_path)
 
@@ -222,5 +228,155 @@ class TestIceClock(unittest.TestCase):
     img_io = render_app(self.clock, end_num, end_percentage)
     self.image_test(img_io, golden_path)
 
+  def test_partial_redraw(self):
+    # Drawing only the regions that changed gives the same image as drawing the whole frame
+    render_app(self.clock, 1, 0.0)
+    render_app(self.clock, 2, 0.5)
+    partial = pygame.surfarray.array3d(self.clock.screen).copy()
+
+    self.clock._drawn_frame = None
+    render_app(self.clock, 2, 0.5)
+    self.assertTrue(np.array_equal(partial, pygame.surfarray.array3d(self.clock.screen)))
+
+  def test_text_atlas(self):
+    # Times composed from cached glyphs look the same as the font rendering the whole string
+    font = self.clock.fonts["timer"]
+    atlas = app.TextAtlas(font)
+    for text in ("00:00:00", "01:23:45", "12:59:07"):
+      expected = pygame.Surface(font.size(text))
+      expected.blit(font.render(text, True, (255, 255, 255)), (0, 0))
+      composed = pygame.Surface(font.size(text))
+      atlas.blit_time(composed, text, (255, 255, 255), composed.get_rect().center)
+      self.assertTrue(np.array_equal(pygame.surfarray.array3d(expected), pygame.surfarray.array3d(composed)))
+
+  def test_layout_cache(self):
+    # The layout is computed again only when the screen size or configuration changes
+    self.clock._server_config["stones_per_end"] = 8
+    layout = self.clock.layout
+    self.assertIs(layout, self.clock.layout)
+    self.assertEqual(layout.bar_height, layout.section_height * 8)
+
+    self.clock._server_config["stones_per_end"] = 6
+    self.assertIsNot(layout, self.clock.layout)
+    self.assertEqual(self.clock.layout.bar_height, self.clock.layout.section_height * 6)
+
+  def test_bar_cache(self):
+    # The cached bars are reused until the number of stones or the colors change
+    self.clock._server_config["stones_per_end"] = 8
+    layers = self.clock.get_progress_bar_layers(8, self.clock.layout)
+    self.assertIs(layers, self.clock.get_progress_bar_layers(8, self.clock.layout))
+
+    self.clock._server_config["stones_per_end"] = 6
+    self.assertIsNot(layers, self.clock.get_progress_bar_layers(6, self.clock.layout))
+
+    # Palettes that only differ in which colors are shared give different bars
+    def empty_bar(bar_bg):
+      colors = dict(self.clock.styles["colors"], BAR_FG1=(1, 2, 3), BAR_FG2=(4, 5, 6), BAR_BG=bar_bg)
+      self.clock.set_palette(app.compile_palette(dict(self.clock.styles, colors=colors)))
+      self.clock.update_styles()
+      return pygame.surfarray.array3d(self.clock.get_progress_bar_layers(6, self.clock.layout)[0])
+
+    self.assertFalse(np.array_equal(empty_bar((1, 2, 3)), empty_bar((4, 5, 6))))
+
+  def test_font_cache(self):
+    # A clock of the same size reuses the fonts that are already loaded
+    other = app.IceClock(headless=True, styles_path="default_styles.json")
+    self.assertIs(other.fonts["timer"], self.clock.fonts["timer"])
+
+  def test_style_watcher(self):
+    # Swapping the styles symlink the way the admin page does hands over a new palette
+    styles_folder = os.path.join(app.BASE_PATH, "static", "app_styles")
+    with tempfile.TemporaryDirectory() as tmpdir:
+      link = os.path.join(tmpdir, "user_styles.json")
+      os.symlink(os.path.join(styles_folder, "default_styles.json"), link)
+      palettes = []
+      watcher = app.StyleWatcher(link, palettes.append)
+      self.assertFalse(watcher.check())
+
+      os.symlink(os.path.join(styles_folder, "rcc_styles.json"), link + ".tmp")
+      os.replace(link + ".tmp", link)
+      self.assertTrue(watcher.check())
+      self.assertEqual(len(palettes), 1)
+      self.assertEqual(palettes[0].styles, app.read_palette(os.path.join(styles_folder, "rcc_styles.json")).styles)
+
+      # The render thread switches to the new palette on the next frame
+      self.clock.set_palette(palettes[0])
+      self.clock.update_styles()
+      self.assertIs(self.clock.styles, palettes[0].styles)
+      self.assertIs(app.Color, palettes[0].colors)
+
+  def test_next_frame_time(self):
+    # Frames are due just after the next whole second of the server clock
+    self.clock._clock_offset = 1000.25
+    self.clock._messages = []
+    self.clock._is_overtime = False
+    deadline = self.clock.next_frame_time()
+    server_deadline = deadline + self.clock._clock_offset
+    self.assertAlmostEqual(server_deadline - math.floor(server_deadline), app.TICK_MARGIN, places=6)
+    self.assertLessEqual(deadline - time.monotonic(), 1 + app.TICK_MARGIN)
+
+    # and sooner while something animates
+    self.clock._is_overtime = True
+    self.assertLessEqual(self.clock.next_frame_time() - time.monotonic(), 1/app.ANIMATION_FPS)
+
+  def test_extrapolate_past_end(self):
+    # A display keeps showing the end of a game that completed between fetches
+    config = {k: v.value for k,v in server_config.items()}
+    league_time = config["time_per_end"] * config["num_ends"]
+    now = int(time.time())
+
+    # whether it was fetched before or after the end
+    for elapsed in (league_time - 2, league_time + 100):
+      config.update(is_timer_running=True, start_timestamp=now - elapsed, count_in_deadline=0)
+      timer_state.calc_transitions(config)
+      times = timer_state.calc_times(config, now)
+      self.clock._latest_frame = {"config": timer_state.effective_config(config, times), "times": times, "state_version": 1}
+
+      for offset in (0, 5, 10):
+        self.clock._clock_offset = now + offset - time.monotonic()
+        self.clock.update_time()
+        self.assertLessEqual(self.clock._uptime, league_time)
+      self.assertEqual(self.clock._uptime, league_time)
+      self.assertEqual(self.clock._end_number, config["num_ends"] + 1)
+      self.assertTrue(self.clock._server_config["is_game_complete"])
+
+  def test_sync_time_error(self):
+    # An error from the server, such as an unknown sheet, is not a time sync sample
+    class ErrorSession:
+      def get(self, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 404
+        response._content = b'{"error": "Sheet not found"}'
+        return response
+
+    self.clock.session = ErrorSession()
+    self.assertIsNone(self.clock.sync_time())
+    self.assertEqual(len(self.clock._sync_samples), 0)
+
+  def test_message_expiry(self):
+    # Messages are laid out once, and taken down in the order of their deadlines
+    self.clock.add_message("First")
+    self.clock.add_message("Second\nmessage")
+    self.assertEqual(self.clock._messages[-1].lines, ["Second", "message"])
+
+    self.clock._message_deadlines[0] = (0,) + self.clock._message_deadlines[0][1:]
+    self.clock.expire_messages()
+    self.assertEqual([message.lines for message in self.clock._messages], [["Second", "message"]])
+
+  def test_role_map(self):
+    # A frame drawn from its role map in other colors is the same as rendering it in them
+    self.clock.add_message("Hello World!")
+    render_app(self.clock, 2, 0.5)
+    role_map = self.clock.render_role_map()
+    self.assertIsNotNone(role_map)
+
+    rcc = app.read_palette(os.path.join(app.BASE_PATH, "static", "app_styles", "rcc_styles.json"))
+    palette = app.compile_palette(dict(self.clock.styles, colors=rcc.styles["colors"]))
+    self.clock.set_palette(palette)
+    render_app(self.clock, 2, 0.5)
+    swapped = pygame.Surface(self.clock.screen.get_size(), 0, self.clock.screen)
+    role_map.render(palette, swapped)
+    self.assertTrue(np.array_equal(pygame.surfarray.array3d(swapped), pygame.surfarray.array3d(self.clock.screen)))
+
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
@@ -15,6 +15,14 @@ logger.setLevel(logging.INFO)
 jobstores["memory"] = MemoryJobStore()
 scheduler = BlockingScheduler(jobstores=jobstores)
 
+def update_timer(batch):
+  '''
+  Apply a batch of changes to the timer in a single request
+  '''
+  response = requests.post('http://localhost:5000/update', json=batch)
+  if response.status_code != 200:
+    logger.error("Could not update timer: {}".format(response.json().get("error")))
+
 def start_timer(profile):
   game_type = requests.get('http://localhost:5000/config?key=game_type').json().get('game_type', 'league')
   if game_type == "bonspiel":
@@ -22,9 +30,7 @@ def start_timer(profile):
     return
 
   logger.info("Starting timer with profile: {:s}".format(profile))
-  requests.get('http://localhost:5000/load_profile?name={}'.format(profile))
-  requests.get('http://localhost:5000/reset')
-  requests.get('http://localhost:5000/start')
+  update_timer({"reset": True, "profile": profile, "start": True})
 
 def start_one_time_job(profile):
   is_timer_running = requests.get('http://localhost:5000/config?key=is_timer_running').json().get('is_timer_running', False)
@@ -36,26 +42,26 @@ def start_one_time_job(profile):
 
 def start_bonspiel(job_id, time_to_chime, time_per_end, stones_per_end, timer_count_in, allow_ot, count_direction):
   # Load settings for bonspiel
-  settings = [
-    {"key": "game_type", "value": "bonspiel"},
-    {"key": "time_per_end", "value": time_per_end},
-    {"key": "stones_per_end", "value": stones_per_end},
-    {"key": "time_to_chime", "value": time_to_chime},
-    {"key": "count_in", "value": timer_count_in},
-    {"key": "allow_overtime", "value": int(allow_ot)},
-    {"key": "count_direction", "value": count_direction}
-  ]
-  logger.info("Starting {} bonspiel with settings:".format(job_id, settings))
-  for setting in settings:
-    logger.info(" - Setting {} to {}".format(setting["key"], setting["value"]))
-    requests.get('http://localhost:5000/update?key={}&value={}'.format(setting["key"], setting["value"]))
+  settings = {
+    "game_type": "bonspiel",
+    "time_per_end": time_per_end,
+    "stones_per_end": stones_per_end,
+    "time_to_chime": time_to_chime,
+    "count_in": timer_count_in,
+    "allow_overtime": int(allow_ot),
+    "count_direction": count_direction
+  }
+  logger.info("Starting {} bonspiel with settings:".format(job_id))
+  for key, value in settings.items():
+    logger.info(" - Setting {} to {}".format(key, value))
+
+  # All the settings are applied at once, so displays never show a half configured bonspiel
+  update_timer({"values": settings})
 
 def end_bonspiel(job_id):
   logger.info("Ending {} bonspiel and resetting to league defaults.".format(job_id))
   # Set timer back to league defaults
-  requests.get('http://localhost:5000/update?key={}&value={}'.format("game_type", "league"))
-  requests.get('http://localhost:5000/load_profile?name={}'.format("8ends"))
-  requests.get('http://localhost:5000/reset')
+  update_timer({"reset": True, "profile": "8ends", "values": {"game_type": "league"}})
 
 def refresh_jobs():
   """Reload new jobs from the job store."""
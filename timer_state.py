@@ -0,0 +1,251 @@
+'''
+Timer calculations shared by the back end and the front end. These depend only
+on the server configuration and the time they are evaluated at, so a display
+can extrapolate the timer locally between updates from the server.
+
+TimerState holds the configuration of a timer on the back end.
+'''
+from collections import namedtuple
+from collections.abc import Mapping
+from contextlib import contextmanager
+from types import MappingProxyType
+from enum import Enum
+from config import ConfigValue
+import threading
+import time
+
+class Phase(Enum):
+  IDLE = "idle"
+  COUNT_IN = "count_in"
+  RUNNING = "running"
+  PAUSED = "paused"
+  OVERTIME = "overtime"
+  COMPLETE = "complete"
+
+# Phases in which the clock is moving
+RUNNING_PHASES = (Phase.COUNT_IN, Phase.RUNNING, Phase.OVERTIME)
+
+# An immutable view of the configuration, tagged with the state version it was published at
+Snapshot = namedtuple("Snapshot", ["version", "config"])
+
+class Transaction(dict):
+  '''
+  Mutable copy of the configuration used while a change is being applied.
+  Values are converted to the type of their key as they are assigned.
+  '''
+  def __init__(self, types, values):
+    self.types = types
+    dict.__init__(self, values)
+
+  def __setitem__(self, key, value):
+    if key not in self.types:
+      raise KeyError(key)
+    dict.__setitem__(self, key, self.types[key](value))
+
+class TimerState:
+  '''
+  Configuration of a timer, published as immutable snapshots. Writers apply their
+  changes to a copy under a lock and publish the result in a single assignment, so
+  readers never take the lock and never see a half-applied change.
+  '''
+  def __init__(self, config):
+    # config maps each key to a ConfigValue giving its default value and type
+    self.types = {key: value.type_fun for key, value in config.items()}
+    initial = Transaction(self.types, {key: value.value for key, value in config.items()})
+    calc_transitions(initial)
+    self._snapshot = Snapshot(0, MappingProxyType(dict(initial)))
+
+    # Streams wait on this condition for the version to move. Writers hold its lock.
+    self.changed = threading.Condition()
+
+  @property
+  def snapshot(self):
+    return self._snapshot
+
+  @property
+  def version(self):
+    return self._snapshot.version
+
+  @contextmanager
+  def transaction(self):
+    '''
+    Apply a change atomically. The block receives a mutable copy of the current
+    configuration, which is published when the block exits without an exception.
+    Nothing is published if no value changed.
+    '''
+    with self.changed:
+      current = self._snapshot
+      config = Transaction(self.types, current.config)
+      yield config
+      calc_transitions(config)
+      if config != current.config:
+        self._publish(current.version + 1, config)
+
+  def touch(self):
+    '''
+    Move the version without changing the configuration, e.g. when a message is posted
+    '''
+    with self.changed:
+      self._publish(self._snapshot.version + 1, self._snapshot.config)
+
+  def _publish(self, version, config):
+    self._snapshot = Snapshot(version, MappingProxyType(dict(config)))
+    self.changed.notify_all()
+
+class ConfigView(Mapping):
+  '''
+  Read-only view of the latest snapshot of a TimerState, evaluated at the time of
+  access. Each entry is returned as a ConfigValue, the way the configuration was
+  accessed before it moved into TimerState.
+  '''
+  def __init__(self, state):
+    self.state = state
+
+  def current(self):
+    config = self.state.snapshot.config
+    return effective_config(config, calc_times(config, time.time()))
+
+  def __getitem__(self, key):
+    value = self.current()[key]
+    return ConfigValue(value, type(value))
+
+  def __iter__(self):
+    return iter(self.current())
+
+  def __len__(self):
+    return len(self.current())
+
+def calc_league_time(config):
+  return config["time_per_end"] * config["num_ends"]
+
+def calc_total_time(config):
+  if config["game_type"] != "bonspiel":
+    return calc_league_time(config)
+  return config["time_to_chime"]
+
+def calc_num_bonspiel_ends(config):
+  if config["game_type"] != "bonspiel":
+    return
+  time_to_chime = config["time_to_chime"]
+  time_per_end = config["time_per_end"]
+  # int rounds down, so if the chime occurs during an end we need to add
+  # that end, then one more.
+  config["num_ends"] = int(time_to_chime/time_per_end) + 2
+
+def calc_transitions(config):
+  '''
+  Precompute the timestamps at which a running timer moves to its next phase, so
+  that evaluating the timer at any instant only needs a few comparisons. A value
+  of 0 means the transition does not happen.
+  '''
+  if config["allow_overtime"]:
+    config["overtime_timestamp"] = config["start_timestamp"] + calc_total_time(config)
+    config["complete_timestamp"] = 0
+  else:
+    config["overtime_timestamp"] = 0
+    config["complete_timestamp"] = config["start_timestamp"] + calc_league_time(config)
+
+def calc_phase(config, now):
+  '''
+  Phase of the timer at the timestamp `now`
+  '''
+  if config["is_timer_running"]:
+    now = int(now)
+    if now < config["count_in_deadline"]:
+      return Phase.COUNT_IN
+    if config["complete_timestamp"] and now >= config["complete_timestamp"]:
+      return Phase.COMPLETE
+    if config["overtime_timestamp"] and now > config["overtime_timestamp"]:
+      return Phase.OVERTIME
+    return Phase.RUNNING
+
+  uptime = config["stop_timestamp"] - config["start_timestamp"]
+  if not config["allow_overtime"] and uptime >= calc_league_time(config):
+    return Phase.COMPLETE
+  if uptime == 0:
+    return Phase.IDLE
+  return Phase.PAUSED
+
+def is_running(config, now):
+  return calc_phase(config, now) in RUNNING_PHASES
+
+def calc_times(config, now):
+  '''
+  Compute the times shown by the timer from a dictionary of server configuration
+  values at the timestamp `now`
+  '''
+  phase = calc_phase(config, now)
+
+  # Get how long the timer has been running. The clock is held while counting in,
+  # and stops at the end of the game if overtime is not allowed.
+  if phase == Phase.COUNT_IN:
+    uptime = config["count_in_deadline"] - config["start_timestamp"]
+  elif phase == Phase.COMPLETE and config["is_timer_running"]:
+    uptime = config["complete_timestamp"] - config["start_timestamp"]
+  elif config["is_timer_running"]:
+    uptime = int(now) - config["start_timestamp"]
+  else:
+    uptime = config["stop_timestamp"] - config["start_timestamp"]
+
+  # Initialize results dictionary
+  times = {}
+  times["phase"] = phase.value
+  times["uptime"] = uptime
+
+  # Seconds of count in left. A count in that has not been started yet is shown in full.
+  if phase == Phase.COUNT_IN:
+    times["count_in"] = config["count_in_deadline"] - int(now)
+  elif phase in RUNNING_PHASES:
+    times["count_in"] = 0
+  else:
+    times["count_in"] = config["count_in"]
+
+  # End number and percentage are always based on the uptime of the timer
+  times["end_number"] = uptime // config["time_per_end"] + 1
+  times["end_percentage"] = uptime/config["time_per_end"] - times["end_number"] + 1
+
+  # Calculate the total time of the game, then figure out which time to split into
+  # hours, minutes, and seconds depending on if we're counting down or up
+  times["total_time"] = calc_total_time(config)
+  game_time = times["total_time"] - uptime if config["count_direction"] < 0 else uptime
+
+  # Determine if we're over time or not. If allow_overtime is false, then the over time flag will always be false
+  times["is_overtime"] = uptime > times["total_time"] and config["allow_overtime"]
+
+  # If we don't allow overtime and the timer is done, set the time to 0 or total time, so it stays that way
+  if phase == Phase.COMPLETE:
+    game_time = 0 if config["count_direction"] < 0 else times["total_time"]
+
+  # If we're over time, then return how far over time we are
+  if times["is_overtime"] and config["count_direction"] < 0:
+    game_time = game_time*-1
+
+  # Divide the time into hours, minutes, seconds
+  if not times["count_in"]:
+    times["hours"] = game_time // 3600
+    times["minutes"] = (game_time // 60) % 60
+    times["seconds"] = game_time % 60
+  else:
+    times["hours"] = times["count_in"] // 3600
+    times["minutes"] = (times["count_in"] // 60) % 60
+    times["seconds"] = times["count_in"] % 60
+
+  return times
+
+def effective_config(config, times):
+  '''
+  Configuration as seen by the displays: the stored values, with the ones that
+  depend on the time filled in from `times`
+  '''
+  effective = dict(config)
+  effective["is_timer_running"] = Phase(times["phase"]) in RUNNING_PHASES
+  effective["is_game_complete"] = times["phase"] == Phase.COMPLETE.value
+  effective["count_in"] = times["count_in"]
+
+  # A game that completed while the timer was running is seen as stopped at its end,
+  # so that the times evaluated from the effective config stay at the end of the game
+  if config["is_timer_running"] and times["phase"] == Phase.COMPLETE.value:
+    effective["stop_timestamp"] = config["complete_timestamp"]
+    effective["timer_stop_uptime"] = times["uptime"]
+    effective["count_in_deadline"] = 0
+  return effective